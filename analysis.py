@@ -0,0 +1,577 @@
+"""
+Editor side analysis of assembly source.
+
+`IncrementalAnalyzer` keeps the parse result of every line together with
+the label tables, so an edit only re-parses the lines it touched and only
+re-checks the labels those lines define or reference.
+
+`CFG` splits an assembled program into basic blocks, which is enough to
+find unreachable code and to drive the passes of `Optimizer`: constant
+folding, dead store elimination, jump threading and removal of
+unreachable blocks. `optimize` runs them before execution and `score`
+uses them as a cheap static measure of how much a solution wastes.
+"""
+
+import hashlib
+import operator
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+import vm
+
+
+def _shift(table: Dict[str, List[int]], start: int, delta: int):
+    for lines in table.values():
+        for i in range(bisect_left(lines, start), len(lines)):
+            lines[i] += delta
+
+
+class IncrementalAnalyzer:
+    def __init__(self, source: str = "", isa: vm.InstructionSet = None):
+        self.isa = isa or vm.instruction_set(["Base"])
+        self.lines: List[str] = []
+        self.parsed: list = []
+        self.defs: Dict[str, List[int]] = {}  # label -> defining lines
+        self.refs: Dict[str, List[int]] = {}  # label -> referencing lines
+        self.parse_errors: Dict[int, str] = {}
+        self.label_errors: Dict[str, List[Tuple[int, str]]] = {}
+        self.version = 0  # bumped by every edit
+        self._structure = (None, None)  # (version, `structure` result)
+        self.replace(0, 0, source.splitlines())
+
+    def set_source(self, source: str):
+        """
+        Replaces the whole source, re-parsing only the lines between the
+        common prefix and suffix of the old and new text.
+        """
+        new = source.splitlines()
+        old = self.lines
+        start = 0
+        limit = min(len(old), len(new))
+        while start < limit and old[start] == new[start]:
+            start += 1
+        end_old, end_new = len(old), len(new)
+        while (
+            end_old > start and end_new > start and old[end_old - 1] == new[end_new - 1]
+        ):
+            end_old -= 1
+            end_new -= 1
+        if start != end_old or start != end_new:
+            self.replace(start, end_old, new[start:end_new])
+
+    def replace(self, start: int, end: int, new_lines: List[str]):
+        """Replaces lines `start:end` with `new_lines`."""
+        self.version += 1
+        touched = set()
+        for i in range(start, end):
+            self._forget(i, self.parsed[i], touched)
+        self.parse_errors = {
+            (i if i < end else i + len(new_lines) - (end - start)): message
+            for i, message in self.parse_errors.items()
+            if not start <= i < end
+        }
+        delta = len(new_lines) - (end - start)
+        if delta:
+            _shift(self.defs, end, delta)
+            _shift(self.refs, end, delta)
+        parsed = vm.parse_lines(new_lines, self.isa.signatures)
+        self.lines[start:end] = new_lines
+        self.parsed[start:end] = parsed
+        for i, line in enumerate(parsed, start):
+            self._record(i, line, touched)
+        if delta:
+            # line numbers moved, so cached messages of untouched labels did too
+            touched.update(self.label_errors)
+        for name in touched:
+            self._check_label(name)
+
+    def _forget(self, i: int, line, touched: set):
+        if line is None or line[0] == "!":
+            return
+        if line[0] == "#":
+            self.defs[line[1]].remove(i)
+            touched.add(line[1])
+            return
+        for kind, value in line[1]:
+            if kind == "l":
+                self.refs[value].remove(i)
+                touched.add(value)
+
+    def _record(self, i: int, line, touched: set):
+        if line is None:
+            return
+        if line[0] == "!":
+            self.parse_errors[i] = line[1]
+        elif line[0] == "#":
+            insort(self.defs.setdefault(line[1], []), i)
+            touched.add(line[1])
+        else:
+            for kind, value in line[1]:
+                if kind == "l":
+                    insort(self.refs.setdefault(value, []), i)
+                    touched.add(value)
+
+    def _check_label(self, name: str):
+        defs = self.defs.get(name, [])
+        refs = self.refs.get(name, [])
+        errors = [(i, f"duplicate label {name!r}") for i in defs[1:]]
+        if not defs:
+            errors += [(i, f"undefined label {name!r}") for i in refs]
+        if errors:
+            self.label_errors[name] = errors
+        else:
+            self.label_errors.pop(name, None)
+        if not defs and not refs:
+            self.defs.pop(name, None)
+            self.refs.pop(name, None)
+
+    def labels(self) -> Dict[str, int]:
+        return {name: lines[0] for name, lines in self.defs.items() if lines}
+
+    def errors(self) -> List[Tuple[int, str]]:
+        errors = list(self.parse_errors.items())
+        for label_errors in self.label_errors.values():
+            errors += label_errors
+        errors.sort()
+        return errors
+
+    def analysis(self) -> dict:
+        """
+        Labels and errors of `game.analyze`, read from the incremental
+        tables. The control flow part is `structure`.
+        """
+        return {"labels": self.labels(), "errors": self.errors()}
+
+    def structure(self) -> dict:
+        """
+        `structure` of the current source. It needs the whole program, so
+        it is only computed on request and kept until the next edit.
+        """
+        version, result = self._structure
+        if version != self.version:
+            errors = self.errors()
+            program, _ = vm.assemble_parsed("\n".join(self.lines), self.parsed)
+            program.isa = self.isa
+            result = structure(program, errors)
+            self._structure = (self.version, result)
+        return result
+
+    def program(self) -> vm.Program:
+        """Assembles from the cached parse results, raising `vm.AsmError`."""
+        program, errors = vm.assemble_parsed("\n".join(self.lines), self.parsed)
+        program.isa = self.isa
+        if errors:
+            raise vm.AsmError(errors)
+        return program
+
+
+ALL_REGISTERS = (1 << vm.REGISTER_COUNT) - 1
+
+_BRANCHES = {
+    "jeq": operator.eq,
+    "jne": operator.ne,
+    "jlt": operator.lt,
+    "jgt": operator.gt,
+}
+# Same results as the step factories in `vm`, None when the VM would fault
+_FOLD = {
+    "add": lambda a, b, mask: (a + b) & mask,
+    "sub": lambda a, b, mask: (a - b) & mask,
+    "mul": lambda a, b, mask: (a * b) & mask,
+    "div": lambda a, b, mask: (a // b) & mask if b else None,
+    "mod": lambda a, b, mask: (a % b) & mask if b else None,
+    "and": lambda a, b, mask: a & b,
+    "or": lambda a, b, mask: a | b,
+    "xor": lambda a, b, mask: a ^ b,
+    "shl": lambda a, b, mask: (a << b if b < 128 else 0) & mask,
+    "shr": lambda a, b, mask: a >> b,
+    "min": lambda a, b, mask: min(a, b),
+    "max": lambda a, b, mask: max(a, b),
+}
+# Ops without side effects, removable when their result is never read
+_PURE = set(_FOLD) | {"mov", "core"}
+
+
+class Block:
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end  # exclusive
+        self.successors: List[int] = []
+        self.predecessors: List[int] = []
+        self.exits = False  # control can leave the program from here
+
+
+class CFG:
+    """
+    Basic blocks of `code`, a list of instructions starting with
+    `(op, operands)` whose label operands are indices into the list. A
+    target outside the list, including the unresolved `-1` of an
+    undefined label, leaves the program.
+    """
+
+    def __init__(self, code: list, signatures: Dict[str, str]):
+        self.code = code
+        n = len(code)
+        targets = {
+            op: [i for i, kind in enumerate(signature) if kind == "l"]
+            for op, signature in signatures.items()
+        }
+        leaders = {0}
+        for pc, (op, operands, *_) in enumerate(code):
+            positions = targets.get(op, ())
+            if positions or op == "halt":
+                leaders.add(pc + 1)
+            leaders.update(operands[i] for i in positions)
+        starts = sorted(pc for pc in leaders if 0 <= pc < n)
+        self.blocks = [Block(a, b) for a, b in zip(starts, starts[1:] + [n])]
+        self.block_of = [0] * n
+        for index, block in enumerate(self.blocks):
+            self.block_of[block.start : block.end] = [index] * (block.end - block.start)
+        for index, block in enumerate(self.blocks):
+            op, operands, *_ = code[block.end - 1]
+            following = [operands[i] for i in targets.get(op, ())]
+            if op not in ("jump", "halt"):
+                following.append(block.end)
+            block.exits = op == "halt"
+            for pc in following:
+                if not 0 <= pc < n:
+                    block.exits = True
+                elif self.block_of[pc] not in block.successors:
+                    block.successors.append(self.block_of[pc])
+                    self.blocks[self.block_of[pc]].predecessors.append(index)
+
+    def reachable(self) -> List[bool]:
+        """Whether each block can run, starting from the first one."""
+        seen = [False] * len(self.blocks)
+        stack = [0] if self.blocks else []
+        while stack:
+            index = stack.pop()
+            if not seen[index]:
+                seen[index] = True
+                stack += self.blocks[index].successors
+        return seen
+
+    def liveness(self, uses: List[Tuple[int, int]]) -> List[int]:
+        """
+        Registers live after every instruction as bit masks, given the
+        `(read, written)` masks of each one. Every register is live when
+        the program ends since the registers stay on screen.
+        """
+        blocks = self.blocks
+        live_in = [0] * len(blocks)
+        work = list(range(len(blocks)))
+        queued = [True] * len(blocks)
+
+        def live_out(block: Block) -> int:
+            live = ALL_REGISTERS if block.exits else 0
+            for successor in block.successors:
+                live |= live_in[successor]
+            return live
+
+        while work:
+            index = work.pop()
+            queued[index] = False
+            block = blocks[index]
+            live = live_out(block)
+            for pc in range(block.end - 1, block.start - 1, -1):
+                read, written = uses[pc]
+                live = (live & ~written) | read
+            if live != live_in[index]:
+                live_in[index] = live
+                for predecessor in block.predecessors:
+                    if not queued[predecessor]:
+                        queued[predecessor] = True
+                        work.append(predecessor)
+
+        after = [0] * len(self.code)
+        for block in blocks:
+            live = live_out(block)
+            for pc in range(block.end - 1, block.start - 1, -1):
+                after[pc] = live
+                read, written = uses[pc]
+                live = (live & ~written) | read
+        return after
+
+
+class Optimizer:
+    """
+    Semantics preserving rewrites of a program. Registers, memory, output
+    and faults end up the same as when running the original, only fewer
+    instructions are executed and a fault names the instruction of the
+    rewritten program. Every register counts as read wherever the program
+    can stop, including instructions that may fault, so nothing visible
+    at a fault is removed or moved past it. Ops from extensions that
+    replaced a built-in step factory are treated as unknown and left alone.
+
+    Instructions are held as `(op, operands, line, origin)` where `origin`
+    is the index of the untouched source instruction, or None once a pass
+    rewrote it.
+    """
+
+    def __init__(self, program: vm.Program):
+        self.source = program
+        self.isa = program.isa or vm.instruction_set(["Base"])
+        self.mask = self.isa.mask
+        known = vm.builtin_ops()
+        self.builtin = {
+            op for op, factory in self.isa.factories.items() if known.get(factory) == op
+        }
+        self.targets = {
+            op: {i for i, kind in enumerate(signature) if kind == "l"}
+            for op, signature in self.isa.signatures.items()
+        }
+        self.consts = list(program.consts)
+        self.slots = {}
+        for i, value in enumerate(program.consts):
+            self.slots.setdefault(value & self.mask, vm.REGISTER_COUNT + i)
+        self.code = [
+            (op, operands, line, pc)
+            for pc, ((op, operands), line) in enumerate(
+                zip(program.code, program.lines)
+            )
+        ]
+        self.labels = dict(program.labels)
+        self.passes: List[str] = []
+
+    def run(self, passes=None, rounds: int = 4) -> "Optimizer":
+        """Runs `passes` (default all of `PASSES`) until nothing changes."""
+        passes = list(passes or PASSES)
+        self.passes += passes
+        for _ in range(rounds):
+            changed = False
+            for name in passes:
+                changed |= PASSES[name](self)
+            if not changed:
+                break
+        return self
+
+    def _value(self, slot: int, known: Dict[int, int]) -> Optional[int]:
+        if slot >= vm.REGISTER_COUNT:
+            return self.consts[slot - vm.REGISTER_COUNT] & self.mask
+        return known.get(slot)
+
+    def _const(self, value: int) -> int:
+        if value not in self.slots:
+            self.slots[value] = vm.REGISTER_COUNT + len(self.consts)
+            self.consts.append(value)
+        return self.slots[value]
+
+    def _can_fault(self, op: str, operands: tuple) -> bool:
+        if op in ("div", "mod"):
+            return not self._value(operands[2], {})  # unless a nonzero constant
+        return op in ("load", "store", "in")
+
+    def _uses(self, op: str, operands: tuple) -> Tuple[int, int]:
+        if op not in self.builtin or op in ("sys", "halt"):
+            # stage defined calls may look at the registers, and so does
+            # anyone watching them after the program stops
+            return ALL_REGISTERS, 0
+        read = written = 0
+        for kind, slot in zip(self.isa.signatures[op], operands):
+            if kind == "r":
+                written |= 1 << slot
+            elif kind == "v" and slot < vm.REGISTER_COUNT:
+                read |= 1 << slot
+        if self._can_fault(op, operands):
+            read = ALL_REGISTERS  # the program may stop here
+        return read, written
+
+    def _compact(self, code: list):
+        """Drops the None entries of `code`, moving targets past them."""
+        index, kept = [], 0
+        for item in code:
+            index.append(kept)
+            kept += item is not None
+        index.append(kept)
+
+        def moved(pc: int) -> int:
+            return index[pc] if 0 <= pc < len(index) else pc
+
+        self.code = []
+        for item in code:
+            if item is None:
+                continue
+            op, operands, line, origin = item
+            if self.targets.get(op):
+                operands = tuple(
+                    moved(value) if i in self.targets[op] else value
+                    for i, value in enumerate(operands)
+                )
+            self.code.append((op, operands, line, origin))
+        self.labels = {name: moved(pc) for name, pc in self.labels.items()}
+
+    def remove_unreachable(self) -> bool:
+        cfg = CFG(self.code, self.isa.signatures)
+        reachable = cfg.reachable()
+        if all(reachable):
+            return False
+        self._compact(
+            [
+                item if reachable[cfg.block_of[pc]] else None
+                for pc, item in enumerate(self.code)
+            ]
+        )
+        return True
+
+    def fold_constants(self) -> bool:
+        """
+        Replaces results computed from known values by `mov` of the value
+        and decided branches by `jump` or nothing. Values are tracked
+        within a block, all registers start as zero in the first one.
+        """
+        if not {"mov", "jump"} <= self.builtin:
+            return False
+        cfg = CFG(self.code, self.isa.signatures)
+        code = list(self.code)
+        changed = False
+        for index, block in enumerate(cfg.blocks):
+            known = {}
+            if index == 0 and not block.predecessors:
+                known = dict.fromkeys(range(vm.REGISTER_COUNT), 0)
+            for pc in range(block.start, block.end):
+                op, operands, line, origin = code[pc]
+                if op not in self.builtin or op == "sys":
+                    known.clear()
+                    continue
+                if self._can_fault(op, operands):
+                    known.clear()  # values are not carried past a fault
+                if op in _BRANCHES:
+                    a = self._value(operands[0], known)
+                    b = self._value(operands[1], known)
+                    if a is not None and b is not None:
+                        taken = _BRANCHES[op](a, b)
+                        code[pc] = ("jump", operands[2:], line, None) if taken else None
+                        changed = True
+                    continue
+                if not self.isa.signatures[op].startswith("r"):
+                    continue
+                d, *sources = operands
+                value = None
+                if op == "mov":
+                    value = self._value(sources[0], known)
+                elif op in _FOLD:
+                    a, b = (self._value(slot, known) for slot in sources)
+                    if a is not None and b is not None:
+                        value = _FOLD[op](a, b, self.mask)
+                if value is None:
+                    known.pop(d, None)
+                    continue
+                known[d] = value
+                if op != "mov" or sources[0] < vm.REGISTER_COUNT:
+                    code[pc] = ("mov", (d, self._const(value)), line, None)
+                    changed = True
+        if changed:
+            self._compact(code)
+        return changed
+
+    def eliminate_dead_stores(self) -> bool:
+        """Removes side effect free instructions whose result is never read."""
+        cfg = CFG(self.code, self.isa.signatures)
+        live = cfg.liveness(
+            [self._uses(op, operands) for op, operands, *_ in self.code]
+        )
+        code = list(self.code)
+        changed = False
+        for pc, (op, operands, line, origin) in enumerate(self.code):
+            if op not in _PURE or op not in self.builtin or live[pc] >> operands[0] & 1:
+                continue
+            if self._can_fault(op, operands):
+                continue
+            code[pc] = None
+            changed = True
+        if changed:
+            self._compact(code)
+        return changed
+
+    def thread_jumps(self) -> bool:
+        """
+        Points jumps and branches that land on a `jump` at its target,
+        turns jumps to `halt` into `halt` and drops jumps to the next
+        instruction.
+        """
+        if "jump" not in self.builtin:
+            return False
+        n = len(self.code)
+        code = list(self.code)
+        changed = False
+        for pc, (op, operands, line, origin) in enumerate(self.code):
+            if op != "jump" and op not in _BRANCHES or op not in self.builtin:
+                continue
+            target, seen = operands[-1], {pc}
+            while 0 <= target < n and self.code[target][0] == "jump":
+                if target in seen:
+                    break
+                seen.add(target)
+                target = self.code[target][1][0]
+            if target == pc + 1:
+                code[pc] = None
+            elif op == "jump" and 0 <= target < n and self.code[target][0] == "halt":
+                code[pc] = ("halt", (), line, None)
+            elif target != operands[-1]:
+                code[pc] = (op, operands[:-1] + (target,), line, None)
+            else:
+                continue
+            changed = True
+        if changed:
+            self._compact(code)
+        return changed
+
+    def program(self) -> vm.Program:
+        """The rewritten program, sharing source and labels with the original."""
+        source = self.source
+        program = vm.Program(source.source)
+        program.hash = hashlib.sha1(
+            f"{source.hash}:{','.join(self.passes)}".encode()
+        ).hexdigest()
+        program.code = [(op, operands) for op, operands, *_ in self.code]
+        program.lines = [line for _, _, line, _ in self.code]
+        program.consts = list(self.consts)
+        program.labels = dict(self.labels)
+        program.label_lines = dict(source.label_lines)
+        program.isa = source.isa
+        return program
+
+    def score(self) -> float:
+        """Share of the source instructions the passes left untouched."""
+        if not self.source.code:
+            return 1.0
+        kept = sum(origin is not None for *_, origin in self.code)
+        return kept / len(self.source.code)
+
+
+PASSES = {
+    "unreachable": Optimizer.remove_unreachable,
+    "fold": Optimizer.fold_constants,
+    "dse": Optimizer.eliminate_dead_stores,
+    "thread": Optimizer.thread_jumps,
+}
+
+
+def optimize(program: vm.Program, passes=None) -> vm.Program:
+    return Optimizer(program).run(passes).program()
+
+
+def score(program: vm.Program) -> float:
+    """
+    1.0 when no pass finds anything to remove or simplify, lower the more
+    of the program is dead, unreachable or computable ahead of time.
+    """
+    return Optimizer(program).run().score()
+
+
+def structure(program: vm.Program, errors=()) -> dict:
+    """
+    The control flow part of `game.analyze`: source lines that can never
+    run and the `score` of the program, None while it has errors.
+    """
+    isa = program.isa or vm.instruction_set(["Base"])
+    cfg = CFG(program.code, isa.signatures)
+    reachable = cfg.reachable()
+    return {
+        "unreachable": [
+            line
+            for pc, line in enumerate(program.lines)
+            if not reachable[cfg.block_of[pc]]
+        ],
+        "score": None if errors else score(program),
+    }
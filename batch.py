@@ -0,0 +1,328 @@
+"""
+Batched execution of one program over many independent lanes.
+
+`BatchVM` runs a `vm.Program` once per input sequence, with registers
+and memory of every lane held in NumPy arrays. Each iteration executes
+the instruction at the lowest program counter among the live lanes for
+all lanes sitting on it, so lanes that agree on control flow share one
+interpreter step and lanes that diverge on a branch are masked out until
+they meet again. Results are identical to running `vm.VM` per lane.
+
+NumPy is an optional dependency; importing this module fails without it.
+"""
+
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+import vm
+
+_STOPPED = np.iinfo(np.int64).max  # program counter of lanes not running
+
+
+def _lanes(batch, sel):
+    return batch.all_lanes if sel is None else np.flatnonzero(sel)
+
+
+def _read(row, sel):
+    return row if sel is None else row[sel]
+
+
+def _write(row, sel, values):
+    if sel is None:
+        row[:] = values
+    else:
+        row[sel] = values
+
+
+# Vector step factories mirror the scalar ones in `vm`. A step receives a
+# lane mask (None for every lane) and returns the next program counter of
+# those lanes, a scalar or an array.
+
+
+def _op_nop(batch, pc):
+    nxt = pc + 1
+    return lambda sel: nxt
+
+
+def _op_halt(batch, pc):
+    def step(sel):
+        batch.halted[_lanes(batch, sel)] = True
+        batch.stopped_pc[_lanes(batch, sel)] = pc
+        return _STOPPED
+
+    return step
+
+
+def _op_mov(batch, pc, d, a):
+    R, nxt = batch.registers, pc + 1
+
+    def step(sel):
+        _write(R[d], sel, _read(R[a], sel))
+        return nxt
+
+    return step
+
+
+def _binary(fn):
+    def factory(batch, pc, d, a, b):
+        R, mask, nxt = batch.registers, batch.mask, pc + 1
+
+        def step(sel):
+            _write(R[d], sel, fn(_read(R[a], sel), _read(R[b], sel)) & mask)
+            return nxt
+
+        return step
+
+    return factory
+
+
+def _division(fn):
+    def factory(batch, pc, d, a, b):
+        R, mask, nxt = batch.registers, batch.mask, pc + 1
+
+        def step(sel):
+            divisor = _read(R[b], sel)
+            zero = divisor == 0
+            if not zero.any():
+                _write(R[d], sel, fn(_read(R[a], sel), divisor) & mask)
+                return nxt
+            lanes = _lanes(batch, sel)
+            ok = lanes[~zero]
+            R[d][ok] = fn(R[a][ok], R[b][ok]) & mask
+            batch.trap(lanes[zero], "division by zero", pc)
+            return np.where(zero, _STOPPED, nxt)
+
+        return step
+
+    return factory
+
+
+def _shift(fn):
+    def shifted(a, b):
+        return np.where(b < 64, fn(a, b & np.uint64(63)), np.uint64(0))
+
+    return _binary(shifted)
+
+
+def _op_load(batch, pc, d, a):
+    R, M, nxt = batch.registers, batch.memory, pc + 1
+    size = M.shape[1]
+
+    def step(sel):
+        lanes = _lanes(batch, sel)
+        address = _read(R[a], sel)
+        bad = address >= size
+        if bad.any():
+            batch.trap(lanes[bad], "memory access out of range", pc)
+            ok = ~bad
+            R[d][lanes[ok]] = M[lanes[ok], address[ok]]
+            return np.where(bad, _STOPPED, nxt)
+        _write(R[d], sel, M[lanes, address])
+        return nxt
+
+    return step
+
+
+def _op_store(batch, pc, a, b):
+    R, M, nxt = batch.registers, batch.memory, pc + 1
+    size = M.shape[1]
+
+    def step(sel):
+        lanes = _lanes(batch, sel)
+        address = _read(R[a], sel)
+        value = _read(R[b], sel)
+        bad = address >= size
+        if bad.any():
+            batch.trap(lanes[bad], "memory access out of range", pc)
+            ok = ~bad
+            M[lanes[ok], address[ok]] = value[ok]
+            return np.where(bad, _STOPPED, nxt)
+        M[lanes, address] = value
+        return nxt
+
+    return step
+
+
+def _op_jump(batch, pc, target):
+    return lambda sel: target
+
+
+def _branch(compare):
+    def factory(batch, pc, a, b, target):
+        R, nxt = batch.registers, pc + 1
+
+        def step(sel):
+            return np.where(compare(_read(R[a], sel), _read(R[b], sel)), target, nxt)
+
+        return step
+
+    return factory
+
+
+def _op_in(batch, pc, d):
+    R, mask, nxt = batch.registers, batch.mask, pc + 1
+
+    def step(sel):
+        lanes = _lanes(batch, sel)
+        position = batch.input_position[lanes]
+        empty = position >= batch.input_length[lanes]
+        if empty.any():
+            batch.trap(lanes[empty], "input exhausted", pc)
+            lanes, position = lanes[~empty], position[~empty]
+        R[d][lanes] = batch.input[lanes, position] & mask
+        batch.input_position[lanes] += 1
+        return np.where(empty, _STOPPED, nxt) if empty.any() else nxt
+
+    return step
+
+
+def _op_out(batch, pc, a):
+    R, outputs, nxt = batch.registers, batch.outputs, pc + 1
+
+    def step(sel):
+        lanes = _lanes(batch, sel)
+        for lane, value in zip(lanes.tolist(), R[a][lanes].tolist()):
+            outputs[lane].append(value)
+        return nxt
+
+    return step
+
+
+def _op_sys(batch, pc, a):
+    R, nxt = batch.registers, pc + 1
+
+    def step(sel):
+        lanes = _lanes(batch, sel)
+        number = R[a][lanes]
+        if not number.any():
+            batch.halted[lanes] = True
+            batch.stopped_pc[lanes] = pc
+            return _STOPPED
+        halt = number == 0
+        batch.halted[lanes[halt]] = True
+        batch.stopped_pc[lanes[halt]] = pc
+        for lane, n in zip(lanes[~halt].tolist(), number[~halt].tolist()):
+            batch.trap(np.array([lane]), f"unknown system call {n}", pc)
+        return _STOPPED
+
+    return step
+
+
+VECTOR_FACTORIES = {
+    "nop": _op_nop,
+    "halt": _op_halt,
+    "mov": _op_mov,
+    "add": _binary(np.add),
+    "sub": _binary(np.subtract),
+    "mul": _binary(np.multiply),
+    "div": _division(np.floor_divide),
+    "mod": _division(np.remainder),
+    "and": _binary(np.bitwise_and),
+    "or": _binary(np.bitwise_or),
+    "xor": _binary(np.bitwise_xor),
+    "shl": _shift(np.left_shift),
+    "shr": _shift(np.right_shift),
+    "min": _binary(np.minimum),
+    "max": _binary(np.maximum),
+    "load": _op_load,
+    "store": _op_store,
+    "jump": _op_jump,
+    "jeq": _branch(np.equal),
+    "jne": _branch(np.not_equal),
+    "jlt": _branch(np.less),
+    "jgt": _branch(np.greater),
+    "in": _op_in,
+    "out": _op_out,
+    "sys": _op_sys,
+}
+
+
+class BatchVM:
+    """
+    Runs `program` once per entry of `inputs`. Per lane state lives in
+    arrays indexed by lane: `registers[slot]`, `memory[lane]`, `pc`,
+    `steps`, `halted`, plus the `outputs` and `faults` lists.
+
+    Only single core programs are supported, and every instruction of the
+    program needs an entry in `VECTOR_FACTORIES`, otherwise `vm.ISAError`
+    is raised.
+    """
+
+    def __init__(
+        self, program: vm.Program, inputs: Sequence[Sequence[int]], memory_size=256
+    ):
+        isa = program.isa or vm.instruction_set(["Base"])
+        if isa.cores > 1:
+            raise vm.ISAError("batched execution is single core only")
+        n = len(inputs)
+        self.program = program
+        self.lanes = n
+        self.all_lanes = np.arange(n)
+        self.mask = np.uint64(isa.mask)
+        self.registers = np.zeros(
+            (vm.REGISTER_COUNT + len(program.consts), n), np.uint64
+        )
+        for i, c in enumerate(program.consts, vm.REGISTER_COUNT):
+            self.registers[i] = c & isa.mask
+        self.memory = np.zeros((n, memory_size), np.uint64)
+        self.input_length = np.array([len(lane) for lane in inputs], np.int64)
+        self.input = np.zeros((n, max(self.input_length, default=0) + 1), np.uint64)
+        for lane, values in enumerate(inputs):
+            self.input[lane, : len(values)] = [v & isa.mask for v in values]
+        self.input_position = np.zeros(n, np.int64)
+        self.outputs: List[List[int]] = [[] for _ in range(n)]
+        self.faults: List[Optional[vm.VMError]] = [None] * n
+        self.pc = np.zeros(n, np.int64)
+        self.stopped_pc = np.zeros(n, np.int64)
+        self.steps = np.zeros(n, np.int64)
+        self.halted = np.zeros(n, bool)
+        try:
+            self.code = [
+                VECTOR_FACTORIES[op](self, pc, *operands)
+                for pc, (op, operands) in enumerate(program.code)
+            ]
+        except KeyError as e:
+            raise vm.ISAError(f"{e.args[0]!r} has no batched implementation") from None
+        self.code.append(_op_halt(self, len(self.code)))  # falling off the end
+
+    def trap(self, lanes: np.ndarray, message: str, pc: int):
+        for lane in lanes.tolist():
+            self.faults[lane] = vm.VMError(message, pc)
+        self.halted[lanes] = True
+        self.stopped_pc[lanes] = pc
+        self.steps[lanes] -= 1  # a faulting instruction is not counted
+
+    def run(self, max_steps: int) -> int:
+        """
+        Runs every lane for at most `max_steps` instructions and returns
+        how many batched steps it took.
+        """
+        if max_steps <= 0:  # the loop steps before it checks the budget
+            return 0
+        code, steps = self.code, self.steps
+        n = self.lanes
+        key = np.where(self.halted, _STOPPED, self.pc)
+        limit = steps + max_steps
+        iterations = 0
+        while True:
+            pc = int(key.min())
+            if pc == _STOPPED:
+                break
+            sel = key == pc
+            if np.count_nonzero(sel) == n:
+                key[:] = code[pc](None)
+                steps += 1
+            else:
+                key[sel] = code[pc](sel)
+                steps[sel] += 1
+            iterations += 1
+            if iterations >= max_steps:
+                # lanes share steps while they agree, so only now can one
+                # of them reach its limit
+                paused = (steps >= limit) & (key != _STOPPED)
+                if paused.any():
+                    self.pc[paused] = key[paused]
+                    key[paused] = _STOPPED
+        self.pc = np.where(self.halted, self.stopped_pc, self.pc)
+        return iterations
@@ -0,0 +1,330 @@
+"""
+Benchmark suite.
+
+Runs headlessly on SDL's dummy video and audio drivers and writes the
+results as JSON so runs can be compared between commits.
+
+    python bench.py --output before.json
+    python bench.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import pygame  # noqa: E402
+
+import game  # noqa: E402
+import vm  # noqa: E402
+
+FONT = "assets/fonts/DisposableDroidBB.ttf"
+PPCM = 45
+SIZE = (1000, 500)
+
+
+def timed(fn, repeat: int = 1) -> float:
+    """Best wall time of `repeat` calls."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def synthetic_program(lines: int, seed: int = 0) -> str:
+    """Straight-line arithmetic split into labelled loops."""
+    rng = random.Random(seed)
+    ops = ["add", "sub", "mul", "and", "or", "xor", "mov"]
+    out = []
+    for i in range(lines):
+        if i % 20 == 0:
+            out.append(f"#block{i}")
+        elif i % 20 == 19:
+            out.append(f"jlt a0 {rng.randint(1, 1000)} block{i - 19}")
+        else:
+            op = rng.choice(ops)
+            d, a = rng.randrange(8), rng.randrange(8)
+            if op == "mov":
+                out.append(f"mov a{d} {rng.randint(0, 255)}")
+            else:
+                out.append(f"{op} a{d} a{a} {rng.randint(0, 255)}")
+    return "\n".join(out)
+
+
+def new_game(window, dirty_rects: bool = True) -> "game.Game":
+    g = game.Game(window, 30, PPCM, FONT, False, dirty_rects)
+    g.menu_assets.result()
+    g.build_mainmenu()
+    return g
+
+
+def bench_startup(window) -> dict:
+    # The startup jingle is not waited for, only asset loading is measured
+    def start():
+        game.text_cache.clear()
+        g = new_game(window)
+        g.build_stageselect()
+        g.loader.shutdown()
+        g.prefetcher.shutdown()
+        g.audio.shutdown()
+        g.gamesave.close()
+
+    def menu():
+        game.text_cache.clear()
+        g = new_game(window)
+        g.loader.shutdown()
+        g.prefetcher.shutdown()
+        g.audio.shutdown()
+        g.gamesave.close()
+
+    def interactive():
+        # what `Game.start` reports as time to interactive, from creating
+        # the game until the boot screen hands over to the main menu
+        game.text_cache.clear()
+        g = game.Game(window, 30, PPCM, FONT, False)
+        g.running = True
+        g.boot()
+        g.loader.shutdown()
+        g.prefetcher.shutdown()
+        g.audio.shutdown()
+        g.gamesave.close()
+
+    # the caches are warm after the first run and `timed` keeps the best
+    return {
+        "until_menu_seconds": timed(menu, 5),
+        "until_stageselect_seconds": timed(start, 5),
+        "time_to_interactive_seconds": timed(interactive, 5),
+    }
+
+
+def bench_scenes(window, frames: int = 300) -> dict:
+    results = {}
+    for dirty in (False, True):
+        g = new_game(window, dirty)
+        g.build_stageselect()
+        for name in g.scenes:
+            g.switch_scene(name)
+            if name == "levelsel":
+                g.enter_stage()
+                g.run_program("#l\nadd a0 a0 1\njump l")
+
+            def run():
+                for i in range(frames):
+                    g.cursor_pos = (i % g.width, (i * 7) % g.height)
+                    g.handle_hover(*g.cursor_pos)
+                    if dirty:
+                        g.present_dirty()
+                    else:
+                        g.window.fill((0, 0, 0))
+                        g.render(g.window)
+                        g.window.blit(g.cursor[0], g.cursor_pos)
+                        pygame.display.update()
+
+            mode = "dirty" if dirty else "full"
+            results[f"{name}_{mode}_fps"] = frames / timed(run, 3)
+        g.loader.shutdown()
+        g.prefetcher.shutdown()
+        g.audio.shutdown()
+        g.gamesave.close()
+    return results
+
+
+def bench_font_size() -> dict:
+    sample = game.gm("Sample Text")
+    config = game.CONFIG_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        game.CONFIG_DIR = tmp
+
+        def cold():
+            try:
+                os.remove(tmp + "/fontsizes.json")
+            except OSError:
+                pass
+            game.guess_font_size(PPCM, sample, FONT)
+
+        cold_seconds = timed(cold, 5)
+        warm_seconds = timed(lambda: game.guess_font_size(PPCM, sample, FONT), 5)
+    game.CONFIG_DIR = config
+    return {"cold_seconds": cold_seconds, "cached_seconds": warm_seconds}
+
+
+def bench_sprite_sheet() -> dict:
+    results = {}
+    for name, size in (("cursor", (24, 24)), ("logo", (32, 32))):
+        path = f"assets/images/{name}.png"
+        count = len(game.load_sprite_sheet(size, path))
+        results[f"{name}_frames_per_second"] = count / timed(
+            lambda: game.load_sprite_sheet(size, path), 20
+        )
+    path = "assets/images/logo.png"
+    count = len(game.load_sprite_sheet((32, 32), path))
+    config = game.CONFIG_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        game.CONFIG_DIR = tmp
+        for cache in (False, True):
+            results[f"logo_scaled_{'cached_' if cache else ''}frames_per_second"] = (
+                count
+                / timed(
+                    lambda: game.load_sprite_sheet(
+                        (32, 32), path, (150, 150), cache=cache
+                    ),
+                    20,
+                )
+            )
+    game.CONFIG_DIR = config
+    return results
+
+
+def bench_analyze() -> dict:
+    results = {}
+    for lines in (10**2, 10**3, 10**4, 10**5):
+        source = synthetic_program(lines)
+        repeat = max(1, 10**5 // lines)
+        results[f"lines_per_second_{lines}"] = lines / timed(
+            lambda: game.analyze(source), min(repeat, 5)
+        )
+    return results
+
+
+def bench_vm(steps: int = 2_000_000) -> dict:
+    loop = """
+    #loop
+    add a0 a0 1
+    and a1 a0 255
+    store a1 a0
+    jne a0 0 loop
+    """
+    results = {}
+    program = vm.assemble(synthetic_program(1000, seed=1))
+    for jit in (False, True):
+        tier = "jit_" if jit else ""
+        results[f"loop_{tier}instructions_per_second"] = vm.throughput(
+            loop, steps, jit=jit
+        )
+
+        def run():
+            machine = vm.VM(program, jit=jit)
+            done = 0
+            while done < steps and not machine.halted:
+                done += machine.run(steps - done)
+            return done
+
+        executed = run()
+        results[f"synthetic_{tier}instructions_per_second"] = executed / timed(run, 3)
+    results["jit_speedup"] = (
+        results["synthetic_jit_instructions_per_second"]
+        / results["synthetic_instructions_per_second"]
+    )
+
+    try:
+        import batch
+    except ImportError:
+        return results
+    program = vm.assemble(
+        "in a0\n#loop\nsub a0 a0 1\nadd a1 a1 a0\njgt a0 0 loop\nout a1",
+        vm.instruction_set(["Base", "IO"]),
+    )
+    inputs = [[1000 + lane % 16] for lane in range(256)]
+    lanes = batch.BatchVM(program, inputs)
+    lanes.run(steps)
+    executed = int(lanes.steps.sum())
+    results["batch_256_lane_instructions_per_second"] = executed / timed(
+        lambda: batch.BatchVM(program, inputs).run(steps), 3
+    )
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+SUITES = {
+    "startup": lambda window: bench_startup(window),
+    "scenes": lambda window: bench_scenes(window),
+    "font_size": lambda window: bench_font_size(),
+    "sprite_sheet": lambda window: bench_sprite_sheet(),
+    "analyze": lambda window: bench_analyze(),
+    "vm": lambda window: bench_vm(),
+}
+
+
+def compare(results: dict, baseline: dict):
+    print(f"{'benchmark':<50}{'before':>14}{'after':>14}{'ratio':>8}")
+    for suite, values in results["suites"].items():
+        for key, value in values.items():
+            before = baseline.get("suites", {}).get(suite, {}).get(key)
+            if before is None:
+                continue
+            ratio = value / before if before else float("inf")
+            print(f"{suite + '.' + key:<50}{before:>14.4g}{value:>14.4g}{ratio:>8.2f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--only", action="append", choices=sorted(SUITES), help="suites to run"
+    )
+    args = parser.parse_args(argv)
+
+    pygame.init()
+    window = pygame.display.set_mode(SIZE)
+    with open("settings.json") as file:
+        game.lang = json.load(file)["locales"]["lang"]
+
+    # saves and caches of every suite stay out of the player's CONFIG_DIR
+    config = game.CONFIG_DIR
+    results = {"environment": environment(), "suites": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        game.CONFIG_DIR = tmp
+        try:
+            game.reload()
+            for name in args.only or SUITES:
+                print(f"running {name}...", file=sys.stderr)
+                results["suites"][name] = SUITES[name](window)
+        finally:
+            game.CONFIG_DIR = config
+    pygame.quit()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+    else:
+        json.dump(results, sys.stdout, indent=4)
+        print()
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
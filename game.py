@@ -1,37 +1,64 @@
 # This is pure hardwork without any borrowed code. :)
 
+import csv
+import hashlib
+import io
 import json
+import logging
+import os
+import threading
 import time
-from typing import List, Tuple
-from black import os
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
 
 import pygame
 import pygame.mixer
 
+import analysis
+import i18n
+import savestore
+import stages
+import vm
+
 __version__ = "1.0.0"
 
+LAUNCHED = time.perf_counter()
+
+CONFIG_DIR = os.path.expanduser("~/.config/progventures")
+
+log = logging.getLogger("progventures")
+
 lang = "en-gb"
-itable = {}
+catalogue = i18n.catalogue(lang)
 aa = False
 
+# Upper bound for cached stageselect frames, at least 3 are always kept
+STAGE_FRAME_CACHE_BYTES = 64 * 1024 * 1024
+
+# Upper bound for cached rendered strings
+TEXT_CACHE_BYTES = 8 * 1024 * 1024
+
+# Steps a player program may run on a stage before it is killed
+STEP_LIMIT = 10_000_000
+TIME_LIMITED_STEP_LIMIT = 1_000_000
+
 # Internationalization
 def gm(msg: str) -> str:
-    return itable[msg]
+    return catalogue.get(msg)
 
 
 def reload():
-    global itable, lang
-    if len(lang.split("-")) < 2:
-        lang += "-base"
-    with open(f"assets/locales/{lang.split('-')[0]}/{lang.split('-')[1]}.json") as file:
-        itable = json.load(file)
+    global catalogue
+    catalogue = i18n.catalogue(lang, cache_dir=CONFIG_DIR + "/locales")
 
 
 def analyze(asm: str) -> dict:
     """
     Analyzes given assembly instructions and returns
     an analysis for label line locations, errors in
-    instructions.
+    instructions, lines that can never run and a
+    static score, see `analysis.structure`.
 
     For example given the following
 
@@ -47,17 +74,22 @@ def analyze(asm: str) -> dict:
     {
         "labels": {
             "loop": 0
-        }
+        },
+        "errors": [],
+        "unreachable": [],
+        "score": 0.5
     }
     ```
+
+    Errors are `(line, message)` pairs. The loop never ends, so nothing
+    reads `a1` and the `add` is counted as removable in the score.
     """
-    d = {"labels": {}}
-    for i, x in enumerate(asm.splitlines()):
-        x = x.strip()
-        if x == "":
-            pass
-        if x.startswith("#"):
-            d["labels"][x[1:]] = i
+    program, errors = vm.assemble_lines(asm.splitlines())
+    return {
+        "labels": dict(program.label_lines),
+        "errors": errors,
+        **analysis.structure(program, errors),
+    }
 
 
 class TextButton:
@@ -75,13 +107,32 @@ class TextButton:
         centering: bool = True,
         bottom_aligned: bool = False,
     ):
-        self.text_normal = font.render(text, aa, (hover_color))
-        self.text_hover = font.render(text, aa, color)
+        self.font = font
+        self.dest = dest
+        self.invis_width = invis_width
+        self.padding_h = padding_h
+        self.padding_w = padding_w
+        self.centering = centering
+        self.bottom_aligned = bottom_aligned
         self.mouse_down = False
+        self.color = color
+        self.hover = False
+        self.hover_color = hover_color
+        self.event_bind = event
+        self.set_text(text)
+        self.dirty = False  # look changed since the last frame
+
+    def set_text(self, text: str):
+        # Text from `gm` carries its key so a language switch can redo it
+        self.key = getattr(text, "key", None)
+        font, dest = self.font, self.dest
+        self.text_normal = text_cache.render(font, text, aa, self.hover_color)
+        self.text_hover = text_cache.render(font, text, aa, self.color)
         self.rect = self.text_normal.get_rect()
         self.outer_rect = self.text_normal.get_rect()
-        self.outer_rect.width += padding_w
-        self.outer_rect.height += padding_h
+        self.outer_rect.width += self.padding_w
+        self.outer_rect.height += self.padding_h
+        invis_width = self.invis_width
         if invis_width == 0:
             invis_width = self.outer_rect.width + dest[0] * 2
         self.outer_outer_rect = pygame.Rect(
@@ -90,9 +141,9 @@ class TextButton:
                 dest[1]
                 - (
                     (self.outer_rect.h // 2)
-                    if centering
+                    if self.centering
                     else self.outer_rect.h
-                    if bottom_aligned
+                    if self.bottom_aligned
                     else 0
                 ),
             ),
@@ -100,10 +151,14 @@ class TextButton:
         )
         self.outer_rect.center = self.outer_outer_rect.center
         self.rect.center = self.outer_rect.center
-        self.color = color
-        self.hover = False
-        self.hover_color = hover_color
-        self.event_bind = event
+        self.dirty = True
+
+    def retranslate(self):
+        if self.key is not None:
+            self.set_text(gm(self.key))
+
+    def hovered_look(self) -> bool:
+        return self.hover and not self.mouse_down
 
     def render(self, surf: pygame.Surface):
         if (self.mouse_down and self.hover) or not self.hover:
@@ -116,17 +171,32 @@ class TextButton:
             # pygame.draw.rect(surf, self.hover_color, self.outer_rect, 1)
 
     def mouse_button(self, x: int, y: int, mouse: bool):
+        look = self.hovered_look()
         self.mouse_down = mouse
         self.mouse_hover(x, y)
         if not mouse and self.hover and self.event_bind is not None:
             self.event_bind()
             self.hover = False
+        self.dirty |= look != self.hovered_look()
 
     def mouse_hover(self, x: int, y: int):
+        look = self.hovered_look()
         if self.outer_rect.collidepoint(x, y):
             self.hover = True
         else:
             self.hover = False
+        self.dirty |= look != self.hovered_look()
+
+    def mouse_enter(self, mouse: bool):
+        look = self.hovered_look()
+        self.mouse_down = mouse
+        self.hover = True
+        self.dirty |= look != self.hovered_look()
+
+    def mouse_leave(self):
+        look = self.hovered_look()
+        self.hover = False
+        self.dirty |= look != self.hovered_look()
 
 
 class Label:
@@ -138,10 +208,27 @@ class Label:
         invis_width=0,
         dest=(0, 0),
     ):
-        self.text_normal = font.render(text, aa, color)
+        self.font = font
+        self.color = color
+        self.invis_width = invis_width
+        self.dest = dest
+        self.set_text(text)
+        self.dirty = False
+        self.mouse_down = False
+
+    def set_text(self, text: str):
+        self.key = getattr(text, "key", None)
+        self.text_normal = text_cache.render(self.font, text, aa, self.color)
         self.rect = self.text_normal.get_rect()
-        self.outer_rect = pygame.Rect(0, dest[1] - self.rect.h // 2, invis_width, 0)
+        self.outer_rect = pygame.Rect(
+            0, self.dest[1] - self.rect.h // 2, self.invis_width, 0
+        )
         self.rect.center = self.outer_rect.center
+        self.dirty = True
+
+    def retranslate(self):
+        if self.key is not None:
+            self.set_text(gm(self.key))
 
     def render(self, surf: pygame.Surface):
         surf.blit(self.text_normal, self.rect)
@@ -152,34 +239,711 @@ class Label:
     def mouse_hover(self, _x: int, _y: int):
         pass
 
+    def mouse_enter(self, _bool: bool):
+        pass
+
+    def mouse_leave(self):
+        pass
+
 
-def load_sprite_sheet(frame_size: Tuple[int, int], file: str) -> List[pygame.Surface]:
+class WidgetGrid:
+    """
+    Uniform grid over the widgets' `outer_rect`s so a pointer position is
+    only tested against the widgets in its cell.
+    """
+
+    def __init__(self, widgets: list, cell: int = 64):
+        self.widgets = widgets
+        self.cell = cell
+        self.cells = {}
+        for widget in widgets:
+            rect = widget.outer_rect
+            if rect.width <= 0 or rect.height <= 0:
+                continue
+            for cx in range(rect.left // cell, (rect.right - 1) // cell + 1):
+                for cy in range(rect.top // cell, (rect.bottom - 1) // cell + 1):
+                    self.cells.setdefault((cx, cy), []).append(widget)
+
+    def at(self, x: int, y: int) -> list:
+        return [
+            widget
+            for widget in self.cells.get((x // self.cell, y // self.cell), ())
+            if widget.outer_rect.collidepoint(x, y)
+        ]
+
+
+def load_sprite_sheet(
+    frame_size: Tuple[int, int],
+    file: str,
+    scaled_size: Tuple[int, int] = None,
+    scale: Callable = pygame.transform.scale,
+    cache: bool = False,
+) -> List[pygame.Surface]:
+    """
+    Loads a horizontal strip of frames into one atlas converted to the
+    display format, scaling every frame to `scaled_size` with
+    `scale(surface, size)` once. Frames are subsurfaces of the atlas.
+    With `cache` the scaled atlas is also kept in CONFIG_DIR, keyed by the
+    image contents, the scaled size and the qualified name of `scale`,
+    which therefore has to be a named function.
+    """
     width, height = frame_size
-    im = pygame.image.load(file)
-    number_of_frames = int(im.get_width() / width)
-    frames = []
-    for x in range(number_of_frames):
-        dst = pygame.Surface(frame_size, pygame.SRCALPHA)
-        dst.blit(im, (0, 0), pygame.Rect(width * x, 0, width, height))
-        frames.append(dst)
-    return frames
+    scaled_width, scaled_height = scaled_size or frame_size
+    scaler = f"{scale.__module__}.{scale.__qualname__}"
+    if cache and "<" in scaler:  # <lambda> and <locals> share their names
+        raise ValueError(f"cannot cache atlases scaled by {scaler}")
+    with open(file, "rb") as f:
+        data = f.read()
+    key = hashlib.sha1(data)
+    key.update(f"{frame_size}:{scaled_size}:{scaler}".encode())
+    cache_file = f"{CONFIG_DIR}/atlases/{key.hexdigest()}.png"
+
+    atlas = None
+    if cache:
+        try:
+            atlas = pygame.image.load(cache_file)
+        except (OSError, pygame.error):
+            pass
+    if atlas is None:
+        im = pygame.image.load(io.BytesIO(data), file)
+        number_of_frames = im.get_width() // width
+        atlas = pygame.Surface(
+            (scaled_width * number_of_frames, scaled_height), pygame.SRCALPHA
+        )
+        for x in range(number_of_frames):
+            frame = im.subsurface(pygame.Rect(width * x, 0, width, height))
+            if scaled_size:
+                frame = scale(frame, scaled_size)
+            atlas.blit(frame, (scaled_width * x, 0))
+        if cache:
+            try:
+                os.makedirs(CONFIG_DIR + "/atlases", exist_ok=True)
+                pygame.image.save(atlas, cache_file)
+            except (OSError, pygame.error):
+                pass  # only a cache
+    atlas = atlas.convert_alpha()
+    return [
+        atlas.subsurface(pygame.Rect(scaled_width * x, 0, scaled_width, scaled_height))
+        for x in range(atlas.get_width() // scaled_width)
+    ]
+
+
+class SurfaceCache:
+    """
+    Least recently used cache of surfaces bounded by their pixel memory.
+    `min_items` entries are kept even if they alone exceed `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int, min_items: int = 1):
+        self.max_bytes = max_bytes
+        self.min_items = min_items
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def size_of(surf: pygame.Surface) -> int:
+        return surf.get_bytesize() * surf.get_width() * surf.get_height()
+
+    def __contains__(self, key) -> bool:
+        return key in self.items
+
+    def get(self, key):
+        with self.lock:
+            surf = self.items.get(key)
+            if surf is not None:
+                self.items.move_to_end(key)
+            return surf
+
+    def put(self, key, surf: pygame.Surface):
+        with self.lock:
+            if key in self.items:
+                self.bytes -= self.size_of(self.items.pop(key))
+            self.items[key] = surf
+            self.bytes += self.size_of(surf)
+            while self.bytes > self.max_bytes and len(self.items) > self.min_items:
+                _, old = self.items.popitem(last=False)
+                self.bytes -= self.size_of(old)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.bytes = 0
+
+
+# FreeType is not thread safe and the loader and prefetch threads render
+# text too, so every call into a font goes through this lock
+font_lock = threading.RLock()
+
+
+class GlyphAtlas:
+    """
+    Glyphs of one font, color and antialias setting packed side by side on
+    shared pages. Text that changes every frame is composed from cached
+    glyphs instead of being rasterised as a whole string.
+    """
+
+    page_width = 1024
+
+    def __init__(self, font: pygame.font.Font, color, antialias: bool):
+        self.font = font
+        self.color = color
+        self.antialias = antialias
+        with font_lock:
+            self.height = font.get_height()
+        self.pages: List[pygame.Surface] = []
+        self.glyphs = {}  # char -> (page, area, advance)
+        self.x = self.page_width
+
+    def glyph(self, char: str):
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            with font_lock:
+                surf = self.font.render(char, self.antialias, self.color)
+                metrics = self.font.metrics(char)[0]
+            surf = surf.convert_alpha()
+            width = surf.get_width()
+            if self.x + width > self.page_width:
+                self.pages.append(
+                    pygame.Surface(
+                        (max(self.page_width, width), self.height), pygame.SRCALPHA
+                    )
+                )
+                self.x = 0
+            area = pygame.Rect(self.x, 0, width, surf.get_height())
+            # Pages start fully transparent so MAX copies the glyph exactly
+            self.pages[-1].blit(surf, area, special_flags=pygame.BLEND_RGBA_MAX)
+            self.x += width
+            advance = metrics[4] if metrics is not None else width
+            glyph = self.glyphs[char] = (self.pages[-1], area, advance)
+        return glyph
+
+    def draw(self, surf: pygame.Surface, text: str, dest) -> pygame.Rect:
+        x, y = dest
+        for char in text:
+            page, area, advance = self.glyph(char)
+            surf.blit(page, (x, y), area)
+            x += advance
+        return pygame.Rect(dest, (x - dest[0], self.height))
+
+
+class TextCache:
+    """
+    Shared fonts, rendered strings keyed by (font, text, antialias, color)
+    with least recently used eviction, and glyph atlases. The font object
+    stands for its file and size since fonts are only created through
+    `font`.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.strings = SurfaceCache(max_bytes)
+        self.fonts = {}
+        self.atlases = {}
+
+    def font(self, path: str, size: int) -> pygame.font.Font:
+        with font_lock:
+            font = self.fonts.get((path, size))
+            if font is None:
+                font = self.fonts[(path, size)] = pygame.font.Font(path, size)
+            return font
+
+    def render(self, font: pygame.font.Font, text: str, antialias: bool, color):
+        """Like `font.render`. The returned surface is shared, do not draw on it."""
+        key = (font, text, antialias, tuple(color))
+        surf = self.strings.get(key)
+        if surf is None:
+            with font_lock:
+                surf = font.render(text, antialias, color)
+            self.strings.put(key, surf)
+        return surf
+
+    def atlas(self, font: pygame.font.Font, color, antialias: bool) -> GlyphAtlas:
+        key = (font, tuple(color), antialias)
+        atlas = self.atlases.get(key)
+        if atlas is None:
+            atlas = self.atlases[key] = GlyphAtlas(font, color, antialias)
+        return atlas
+
+    def clear(self):
+        self.strings.clear()
+        self.atlases.clear()
+
+
+text_cache = TextCache(TEXT_CACHE_BYTES)
 
 
 class GameSave:
-    def __init__(self):
-        home = os.path.expanduser("~/.config/progventures")
-        os.makedirs(home, exist_ok=True)
-        if not os.path.exists(home + "/gamesave.json"):
-            with open(home + "/gamesave.json", "w") as file:
-                json.dump({"unlock_level": 0}, file)
-        with open(home + "/gamesave.json", "r") as file:
-            info = json.load(file)
-            self.unlock_level = info["unlock_level"]
+    """
+    Player progress, kept in a `savestore.SaveStore` so saving never
+    waits on the disk. The store's snapshot is the `gamesave.json` older
+    versions wrote, so their progress carries over.
+    """
+
+    def __init__(self, home: str = None):
+        self.store = savestore.SaveStore(home or CONFIG_DIR, "gamesave")
+        if self.store.get("unlock_level") is None:
+            self.store.set("unlock_level", 0)
+
+    @property
+    def unlock_level(self) -> int:
+        return self.store.get("unlock_level")
+
+    @unlock_level.setter
+    def unlock_level(self, level: int):
+        self.store.set("unlock_level", level)
+
+    def program(self, stage: str) -> str:
+        """The last program run on `stage`, empty if there was none."""
+        return self.store.get(f"program:{stage}", "")
+
+    def stats(self, stage: str) -> dict:
+        return self.store.get(f"stats:{stage}", {"runs": 0, "best_steps": None})
+
+    def record_run(self, stage: str, source: str):
+        self.store.set(f"program:{stage}", source)
+        stats = dict(self.stats(stage))
+        stats["runs"] += 1
+        self.store.set(f"stats:{stage}", stats)
+
+    def record_result(self, stage: str, steps: int):
+        """Remembers the step count of a run that halted without a fault."""
+        stats = dict(self.stats(stage))
+        if stats["best_steps"] is None or steps < stats["best_steps"]:
+            stats["best_steps"] = steps
+            self.store.set(f"stats:{stage}", stats)
+
+    def close(self):
+        self.store.close()
+
+
+class AudioManager:
+    """
+    Music and sound effects that never block the frame loop.
+
+    Tracks smaller than `stream_bytes` are decoded into `Sound`s on a
+    worker thread and played on two reserved channels, so a new track can
+    fade in while the old one fades out. Larger tracks are streamed by
+    `pygame.mixer.music` rather than decoded whole. Effects play on the
+    remaining `voices` channels, at most `max_voices` copies of one effect
+    at a time. `update` runs every frame: it starts tracks once they are
+    decoded or their turn in the queue came, and drops decoded tracks that
+    are no longer playing or queued. A track or effect that cannot be
+    loaded is logged and skipped, the game carries on without it.
+    """
+
+    def __init__(self, stream_bytes=1024 * 1024, crossfade_ms=300, voices=8):
+        self.enabled = pygame.mixer.get_init() is not None
+        self.stream_bytes = stream_bytes
+        self.crossfade_ms = crossfade_ms
+        self.decoded = {}  # path -> Future of the Sound
+        self.current = None  # (path, channel or None when streamed, ends at)
+        self.pending = None  # (path, loops, fade_ms) waiting to start
+        self.next = None  # (path, loops, fade_ms) after the current track
+        self.effects = {}  # path -> Future of the Sound, None if it failed
+        self.voices = {}  # path -> channels playing that effect
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        if self.enabled:
+            pygame.mixer.set_num_channels(2 + voices)
+            pygame.mixer.set_reserved(2)
+            self.channels = [pygame.mixer.Channel(0), pygame.mixer.Channel(1)]
+
+    def streamed(self, path: str) -> bool:
+        try:
+            return os.path.getsize(path) >= self.stream_bytes
+        except OSError:  # reported by the decoder
+            return False
+
+    @staticmethod
+    def _sound(future, path: str):
+        """The decoded `Sound`, None after logging why decoding failed."""
+        try:
+            return future.result()
+        except Exception as e:  # missing file, unsupported format, ...
+            log.warning("cannot play %s: %s", path, e)
+            return None
+
+    def prefetch(self, path: str):
+        """Starts decoding a track so it can start without a delay."""
+        if self.enabled and path not in self.decoded and not self.streamed(path):
+            self.decoded[path] = self.worker.submit(pygame.mixer.Sound, path)
+
+    def play(self, path: str, loops: int = 0, fade_ms: int = None):
+        """Crossfades to `path` as soon as it is decoded, dropping the queue."""
+        if fade_ms is None:
+            fade_ms = self.crossfade_ms
+        self.next = None
+        self.pending = (path, loops, fade_ms)
+        self.prefetch(path)
+        self.update()
+
+    def queue(self, path: str, loops: int = 0, fade_ms: int = 0):
+        """Plays `path` when the current track ends, fading over its end."""
+        self.next = (path, loops, fade_ms)
+        self.prefetch(path)
+
+    def effect(self, path: str, max_voices: int = 2, volume: float = 1.0):
+        """
+        Plays a sound effect. The first call only starts decoding it, and
+        it is skipped while `max_voices` copies play or no channel is free.
+        """
+        if not self.enabled:
+            return
+        if path not in self.effects:
+            self.effects[path] = self.worker.submit(pygame.mixer.Sound, path)
+            return
+        future = self.effects[path]
+        if future is None or not future.done():
+            return
+        sound = self._sound(future, path)
+        if sound is None:
+            self.effects[path] = None  # not retried
+            return
+        playing = [c for c in self.voices.get(path, ()) if c.get_sound() is sound]
+        if len(playing) >= max_voices:
+            return
+        channel = pygame.mixer.find_channel()
+        if channel is None:
+            return
+        channel.set_volume(volume)
+        channel.play(sound)
+        self.voices[path] = playing + [channel]
+
+    def update(self):
+        if not self.enabled:
+            return
+        if self.pending is None and self.next is not None and self._ending():
+            self.pending, self.next = self.next, None
+        if self.pending is not None:
+            self._start(*self.pending)
+        self._release()
+
+    def _ending(self) -> bool:
+        if self.current is None:
+            return True
+        path, channel, ends_at = self.current
+        if channel is None:
+            return not pygame.mixer.music.get_busy()
+        return time.perf_counter() >= ends_at - self.next[2] / 1000
+
+    def _start(self, path: str, loops: int, fade_ms: int):
+        if self.streamed(path):
+            if self.current is not None and self.current[1] is None:
+                # one music stream at a time, the old one fades out first
+                if fade_ms and pygame.mixer.music.get_busy():
+                    if self.current[2] != -1:
+                        pygame.mixer.music.fadeout(fade_ms)
+                        self.current = (self.current[0], None, -1)  # fading
+                    return
+                pygame.mixer.music.stop()
+            else:
+                self._fade_out(fade_ms)
+            try:
+                pygame.mixer.music.load(path)
+                pygame.mixer.music.play(loops, fade_ms=fade_ms)
+            except pygame.error as e:
+                log.warning("cannot play %s: %s", path, e)
+                self.current = None
+            else:
+                self.current = (path, None, float("inf"))
+        else:
+            future = self.decoded[path]
+            if not future.done():
+                return
+            sound = self._sound(future, path)
+            if sound is None:
+                del self.decoded[path]
+                self.pending = None
+                return
+            channel = self.channels[0]
+            if self.current is not None and self.current[1] is channel:
+                channel = self.channels[1]
+            self._fade_out(fade_ms)
+            channel.play(sound, loops, fade_ms=fade_ms)
+            ends_at = float("inf")
+            if loops >= 0:
+                ends_at = time.perf_counter() + sound.get_length() * (loops + 1)
+            self.current = (path, channel, ends_at)
+        self.pending = None
+
+    def _fade_out(self, fade_ms: int):
+        if self.current is None:
+            return
+        channel = self.current[1]
+        if channel is None:
+            channel = pygame.mixer.music
+        if fade_ms:
+            channel.fadeout(fade_ms)
+        else:
+            channel.stop()
+
+    def _release(self):
+        needed = {
+            track[0] for track in (self.current, self.pending, self.next) if track
+        }
+        sounds = {channel.get_sound() for channel in self.channels}
+        for path, future in list(self.decoded.items()):
+            if path not in needed and future.done():
+                if future.exception() or future.result() not in sounds:
+                    del self.decoded[path]
+
+    def shutdown(self):
+        self.worker.shutdown(cancel_futures=True)
+        if self.enabled:
+            pygame.mixer.music.stop()
+            for channel in self.channels:
+                channel.stop()
+
+
+class FrameProfiler:
+    """
+    Records how long each phase of the game loop took, per frame, in a
+    ring buffer, and draws it as a scrolling stacked graph. Timings are in
+    seconds, `steps` is VM instructions executed during the frame.
+    """
+
+    phases = ("events", "vm", "wait", "render", "cursor", "update")
+    colors = (
+        (80, 160, 255),
+        (255, 80, 200),
+        (60, 60, 60),
+        (80, 255, 120),
+        (255, 220, 60),
+        (255, 120, 60),
+    )
+
+    def __init__(self, fps: int, size: int = 600):
+        self.fps = fps
+        self.frames = deque(maxlen=size)
+        self.timings = [0.0] * len(self.phases)
+        self.steps = 0
+        self.last = time.perf_counter()
+        self.graph = None
+        self.time_to_interactive = None  # seconds from launch to first frame
+
+    def begin(self):
+        self.timings = [0.0] * len(self.phases)
+        self.steps = 0
+        self.last = time.perf_counter()
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self.timings[self.phases.index(phase)] += now - self.last
+        self.last = now
+
+    def end(self):
+        self.frames.append((*self.timings, self.steps))
+
+    def dump(self, path: str):
+        """Writes the recorded frames as CSV or, for other extensions, JSON."""
+        columns = self.phases + ("steps",)
+        with open(path, "w", newline="") as file:
+            if path.endswith(".csv"):
+                writer = csv.writer(file)
+                writer.writerow(columns)
+                writer.writerows(self.frames)
+            else:
+                json.dump([dict(zip(columns, f)) for f in self.frames], file)
+
+    def draw(self, surf: pygame.Surface, rect: pygame.Rect, atlas: "GlyphAtlas"):
+        """
+        Draws the overlay into `rect`. The graph keeps its own surface and
+        only scrolls in the newest frame, one pixel column per frame.
+        """
+        text_h = atlas.height + 4
+        graph_h = rect.h - text_h
+        if self.graph is None or self.graph.get_size() != (rect.w, graph_h):
+            self.graph = pygame.Surface((rect.w, graph_h))
+        budget = 1 / self.fps
+        if self.frames:
+            frame = self.frames[-1]
+            self.graph.scroll(-1, 0)
+            x = rect.w - 1
+            self.graph.fill((0, 0, 0), (x, 0, 1, graph_h))
+            y = graph_h
+            for seconds, color in zip(frame, self.colors):
+                h = int(seconds / (2 * budget) * graph_h)  # top is two frames
+                if h > 0:
+                    self.graph.fill(color, (x, y - h, 1, h))
+                    y -= h
+            self.graph.set_at((x, graph_h // 2), (255, 255, 255))
+        surf.fill((0, 0, 0), rect)
+        surf.blit(self.graph, (rect.x, rect.y + text_h))
+        pygame.draw.rect(surf, (255, 255, 255), rect, 1)
+        recent = list(self.frames)[-self.fps :]
+        if recent:
+            busy = sum(sum(f[:2]) + sum(f[3:6]) for f in recent) / len(recent)
+            total = sum(sum(f[:6]) for f in recent) / len(recent)
+            steps = sum(f[6] for f in recent) // len(recent)
+            text = f"{1 / total if total else 0:4.0f}fps {busy * 1000:5.1f}ms {steps}vm"
+            if self.time_to_interactive is not None:
+                text += f" tti {self.time_to_interactive:.2f}s"
+            atlas.draw(surf, text, (rect.x + 4, rect.y + 2))
+
+
+class Scene:
+    """
+    One screen of the game. `Game` dispatches events and rendering to the
+    active scene and calls `exit` and `enter` on every switch, so a scene
+    can warm its caches when shown and release surfaces when left.
+    """
+
+    name = ""
+
+    def __init__(self, game: "Game"):
+        self.game = game
+
+    def enter(self):
+        pass
+
+    def exit(self):
+        pass
+
+    def widgets(self) -> list:
+        return []
+
+    def interactive_widgets(self) -> list:
+        return self.widgets()
+
+    def state(self) -> tuple:
+        """Anything that, when changed, needs a full redraw."""
+        return ()
+
+    def animated_rects(self) -> list:
+        """Regions redrawn every frame in dirty rectangle mode."""
+        return []
+
+    def key_up(self, key: int):
+        pass
+
+    def mouse_button(self, x: int, y: int, down: bool):
+        """Scene specific handling after widgets got the event."""
+        pass
+
+    def render(self, surf: pygame.Surface):
+        pass
+
+
+class MainMenuScene(Scene):
+    name = "mainmenu"
+
+    def widgets(self) -> list:
+        return list(self.game.mainmenu_buttons.values())
+
+    def render(self, surf: pygame.Surface):
+        game = self.game
+        for v in game.mainmenu_buttons.values():
+            v.render(surf)
+        surf.blit(game.version_text, game.version_text_rect)
+
+
+class StageSelectScene(Scene):
+    name = "stageselect"
+
+    def enter(self):
+        self.game.prefetch_stage_frames(include_current=True)
+
+    def exit(self):
+        self.game.stage_frames.clear()
+
+    def widgets(self) -> list:
+        return [self.game.stageselect_back, self.game.stageselect_enter]
+
+    def interactive_widgets(self) -> list:
+        game = self.game
+        if self.unlocked():
+            return [game.stageselect_back, game.stageselect_enter]
+        return [game.stageselect_back]
+
+    def unlocked(self) -> bool:
+        return self.game.current_logo_index <= self.game.gamesave.unlock_level
+
+    def state(self) -> tuple:
+        return (self.game.current_logo_index, self.game.gamesave.unlock_level)
+
+    def step(self, by: int):
+        game = self.game
+        game.current_logo_index = (game.current_logo_index + by) % len(game.stages)
+
+    def key_up(self, key: int):
+        if key == pygame.K_RIGHT:
+            self.step(1)
+        if key == pygame.K_LEFT:
+            self.step(-1)
+        if key == pygame.K_RETURN or key == pygame.K_KP_ENTER:
+            self.game.enter_stage()
+
+    def mouse_button(self, x: int, y: int, down: bool):
+        game = self.game
+        if self.unlocked() and game.logo_visible_bound_rect.collidepoint(x, y):
+            game.enter_stage()
+        if not down and game.controls_text_rect.collidepoint(x, y):
+            self.step(-1)
+        if not down and game.controls_text2_rect.collidepoint(x, y):
+            self.step(1)
+
+    def render(self, surf: pygame.Surface):
+        game = self.game
+        surf.blit(game.stage_frame(game.current_logo_index), (0, 0))
+        game.prefetch_stage_frames()
+        surf.blit(game.controls_text, game.controls_text_rect)
+        surf.blit(game.controls_text2, game.controls_text2_rect)
+        if not self.unlocked():
+            game.unknown_owner.render(surf)
+            surf.blit(game.logo_locked, game.logo_visible_rect)
+        else:
+            game.owner_label(game.logo_names[game.current_logo_index]).render(surf)
+            game.stageselect_enter.render(surf)
+        game.stageselect_back.render(surf)
+
+
+class LevelSelectScene(Scene):
+    name = "levelsel"
+
+    def exit(self):
+        self.game.watchdog = None  # drops the machine and its memory
+
+    def widgets(self) -> list:
+        return [self.game.levelsel_back]
+
+    def animated_rects(self) -> list:
+        if self.game.watchdog is None:
+            return []
+        return [self.vm_status_rect()]
+
+    def vm_status_rect(self) -> pygame.Rect:
+        game = self.game
+        with font_lock:
+            height = game.text_rendererh2.get_height()
+        return pygame.Rect(0, 0, game.width, height + 20)
+
+    def render(self, surf: pygame.Surface):
+        self.game.levelsel_back.render(surf)
+        if self.game.watchdog is not None:
+            self.render_vm_status(surf)
+
+    def render_vm_status(self, surf: pygame.Surface):
+        machine = self.game.watchdog.machine
+        core = machine.cores[0] if isinstance(machine, vm.MultiCore) else machine
+        if machine.fault is not None:
+            text = str(machine.fault)
+        else:
+            text = f"{machine.steps:>10}  " + " ".join(
+                f"a{i}={v:<5}"
+                for i, v in enumerate(core.registers[: vm.REGISTER_COUNT])
+            )
+        atlas = text_cache.atlas(self.game.text_rendererh2, (255, 255, 255), aa)
+        atlas.draw(surf, text, (10, 10))
 
 
 class Game:
     def __init__(
-        self, window: pygame.Surface, fps: int, ppcm: int, font: str, antialias: bool
+        self,
+        window: pygame.Surface,
+        fps: int,
+        ppcm: int,
+        font: str,
+        antialias: bool,
+        dirty_rects: bool = True,
     ):  # This is where all the assets are really loaded. Too long for a init function
         global aa
         self.font_size = guess_font_size(ppcm, gm("Sample Text"), font)
@@ -187,18 +951,26 @@ class Game:
         self.window = window
         self.font = font
         self.window.fill((0, 0, 0))
-        self.text_renderer = pygame.font.Font(font, self.font_size)
+        self.text_renderer = text_cache.font(font, self.font_size)
         aa = antialias
 
-        loading_text = self.text_renderer.render(gm("Booting"), aa, (255, 255, 255))
-        loading_text_rect = loading_text.get_rect()
-        loading_text_rect.center = self.window.get_rect().center
+        # Boot screen frames are rendered up front so the boot loop never
+        # touches a font while the loader threads do
+        self.boot_frames = [
+            text_cache.render(
+                self.text_renderer, gm("Booting") + "." * i, aa, (255, 255, 255)
+            )
+            for i in range(4)
+        ]
+        self.boot_rect = self.boot_frames[0].get_rect()
+        self.boot_rect.center = self.window.get_rect().center
 
-        self.window.blit(loading_text, loading_text_rect)
+        self.window.blit(self.boot_frames[0], self.boot_rect)
 
-        pygame.mixer.music.load("assets/music/startup_start.mp3")
-        pygame.mixer.music.play()
-        pygame.mixer.music.queue("assets/music/startup_loop.mp3", loops=-1)
+        self.audio = AudioManager()
+        self.audio.prefetch("assets/music/startup_end.mp3")
+        self.audio.play("assets/music/startup_start.mp3", fade_ms=0)
+        self.audio.queue("assets/music/startup_loop.mp3", loops=-1)
 
         pygame.display.update()
 
@@ -207,16 +979,107 @@ class Game:
         self.clock = pygame.time.Clock()
         self.fps = fps
         self.ppcm = ppcm
-        self.text_rendererx1_5 = pygame.font.Font(font, int(self.font_size * 1.5))
-        self.text_rendererx3 = pygame.font.Font(font, self.font_size * 3)
-        self.text_rendererh2 = pygame.font.Font(font, self.font_size // 2)
 
-        self.scene = "mainmenu"
+        self.stageselect_built = False
+        self.time_to_interactive = None
+
+        # F3 toggles the overlay, F4 writes the recorded frames to a file
+        self.profiler = FrameProfiler(fps)
+        self.show_profiler = False
+        self.profiler_drawn = False
+
+        self.scenes = {
+            scene.name: scene(self)
+            for scene in (MainMenuScene, StageSelectScene, LevelSelectScene)
+        }
+        self.active_scene = self.scenes["mainmenu"]
         self.cursor_state = "up"
         self.running = False
+        self.stage_isa = None
+        self.watchdog = None
+
+        # Dirty rectangle rendering. `canvas` holds the scene without the
+        # cursor so regions can be restored without redrawing everything.
+        self.dirty_rects = dirty_rects
+        self.canvas = pygame.Surface(window.get_size()).convert()
+        self.drawn_state = None
+        self.drawn_cursor = None
+
+        self.cursor_name = ["up", "down"]
+        self.cursor_pos = (0, 0)
+
+        # Pointer routing, see `widget_grid`
+        self.grid = None
+        self.grid_key = None
+        self.hovered = []
+        self.mouse_down = False
+
+        # Scene "stageselect", listed from the index of the stage packs
+        self.stages = stages.Catalogue(cache_dir=CONFIG_DIR + "/stages")
+        self.logo_names = self.stages.ids()
+        self.stage = None  # definition of the entered stage
+        self.logo_sheets = {}  # image path -> frames, loaded as stages show up
+        self.owner = None  # (stage, owner Label) of the stage on screen
+        self.current_logo_index = 0
+        # Stage frames are rendered the first time a stage is shown and
+        # neighbours of the current stage are prefetched on a worker thread
+        self.stage_frames = SurfaceCache(STAGE_FRAME_CACHE_BYTES, min_items=3)
+        self.stage_frame_lock = threading.Lock()
+        self.prefetcher = ThreadPoolExecutor(max_workers=1)
+        self.prefetching = set()
+
+        # Assets are decoded on worker threads while `boot` keeps the window
+        # responsive. Their font calls are serialised by `font_lock`.
+        self.loader = ThreadPoolExecutor(max_workers=2)
+        self.menu_assets = self.loader.submit(self.load_menu_assets)
+        self.stage_assets = self.loader.submit(self.load_stage_assets)
+
+    def load_menu_assets(self):  # Runs on a loader thread
+        self.text_rendererx1_5 = text_cache.font(self.font, int(self.font_size * 1.5))
+        self.text_rendererx3 = text_cache.font(self.font, self.font_size * 3)
+        self.text_rendererh2 = text_cache.font(self.font, self.font_size // 2)
+
+        # Cursor Setup
+        self.cursor = load_sprite_sheet(
+            (24, 24),
+            "assets/images/cursor.png",
+            (48, 48),
+            lambda im, size: pygame.transform.scale2x(im),
+        )
+
+    def load_stage_assets(self):  # Runs on a loader thread
+        self.logo_size = (int(0.3 * self.height), int(0.3 * self.height))
+        self.logo_locked = load_sprite_sheet(
+            (32, 32), "assets/images/locked.png", self.logo_size, cache=True
+        )[0]
+        self.stage_logo(self.logo_names[0])
+
+    def stage_logo(self, name: str) -> pygame.Surface:
+        """Logo of stage `name`, loading the sheet it is on when first needed."""
+        logo = self.stages.stage(name)["logo"]
+        frames = self.logo_sheets.get(logo["image"])
+        if frames is None:
+            frames = load_sprite_sheet(
+                (32, 32), logo["image"], self.logo_size, cache=True
+            )
+            self.logo_sheets[logo["image"]] = frames
+        return frames[logo["frame"]]
+
+    def owner_label(self, name: str) -> "Label":
+        if self.owner is None or self.owner[0] != name:
+            label = Label(
+                self.stages.stage(name)["owner"],
+                self.text_renderer,
+                invis_width=self.width,
+                dest=(0, self.logo_visible_bound_rect.top - self.ppcm + 20),
+            )
+            self.owner = (name, label)
+        return self.owner[1]
 
+    def build_mainmenu(self):
         def evt_start():
-            self.scene = "stageselect"
+            self.build_stageselect()
+            self.switch_scene("stageselect")
 
         def evt_quit():
             self.running = False
@@ -235,7 +1098,7 @@ class Game:
                 invis_width=self.width,
                 dest=(
                     self.width // 2,
-                    self.height // 2.5 + 0 * (ppcm + int(0.1 * ppcm)),
+                    self.height // 2.5 + 0 * (self.ppcm + int(0.1 * self.ppcm)),
                 ),
                 padding_h=0,
                 event=evt_start,
@@ -246,7 +1109,7 @@ class Game:
                 invis_width=self.width,
                 dest=(
                     self.width // 2,
-                    (self.height // 2.5) + 1 * (ppcm + int(0.1 * ppcm)),
+                    (self.height // 2.5) + 1 * (self.ppcm + int(0.1 * self.ppcm)),
                 ),
                 padding_h=0,
             ),
@@ -256,7 +1119,7 @@ class Game:
                 invis_width=self.width,
                 dest=(
                     self.width // 2,
-                    (self.height // 2.5) + 2 * (ppcm + int(0.1 * ppcm)),
+                    (self.height // 2.5) + 2 * (self.ppcm + int(0.1 * self.ppcm)),
                 ),
                 padding_h=0,
             ),
@@ -266,7 +1129,7 @@ class Game:
                 invis_width=self.width,
                 dest=(
                     self.width // 2,
-                    (self.height // 2.5) + 3 * (ppcm + int(0.1 * ppcm)),
+                    (self.height // 2.5) + 3 * (self.ppcm + int(0.1 * self.ppcm)),
                 ),
                 padding_h=0,
             ),
@@ -276,197 +1139,22 @@ class Game:
                 invis_width=self.width,
                 dest=(
                     self.width // 2,
-                    (self.height // 2.5) + 4 * (ppcm + int(0.1 * ppcm)),
+                    (self.height // 2.5) + 4 * (self.ppcm + int(0.1 * self.ppcm)),
                 ),
                 padding_h=0,
                 event=evt_quit,
             ),
         }
-        self.version_text = self.text_rendererh2.render(
-            "v" + __version__, aa, (255, 255, 255)
+        self.version_text = text_cache.render(
+            self.text_rendererh2, "v" + __version__, aa, (255, 255, 255)
         )
         self.version_text_rect = self.version_text.get_rect()
         self.version_text_rect.bottomright = (self.width - 1, self.height - 1)
 
-        # Cursor Setup
-        self.cursor = load_sprite_sheet((24, 24), "assets/images/cursor.png")
-        for i, im in enumerate(self.cursor):
-            self.cursor[i] = pygame.transform.scale2x(im)
-        self.cursor_name = ["up", "down"]
-        self.cursor_pos = (0, 0)
-
-        # Logo Setup # Scene "stageselect"
-        logos = load_sprite_sheet((32, 32), "assets/images/logo.png")
-        self.logo_locked = pygame.transform.scale(
-            pygame.image.load("assets/images/locked.png"),
-            (int(0.3 * self.height), int(0.3 * self.height)),
-        )
-        self.logo_names = logo_names = [
-            "helios",
-            "dos",
-            "win95",
-            "osx",
-            "windows",
-            "freebsd",
-            "macos",
-            "linux",
-        ]
-        self.logos = {
-            k: pygame.transform.scale(
-                v, (int(0.3 * self.height), int(0.3 * self.height))
-            )
-            for k, v in zip(logo_names, logos)
-        }
-        self.logo_information = {
-            "helios": {
-                "company": "SoftCorp",
-                "name": "Helios 1.0",
-                "year": "1970",
-                "security-level": "0",
-                "security-measures": ["Null"],
-                "isa": ["Base"],
-                "weakness": ["Buffer Overflow", "Fibinocci Password"],
-                "owner": "Unknown",
-            },  # Helios 1.0
-            "dos": {
-                "company": "MicroSoft",
-                "name": "MS DOS",
-                "year": "1981",
-                "security-level": "1",
-                "security-measures": ["CipherPass 1.0"],
-                "isa": ["Base", "IO", "SysCall"],
-                "weakness": [
-                    "Buffer Overflow",
-                    "CipherBased Password",
-                    "Disk Unencrypted",
-                ],
-                "owner": "Unknown",
-            },  # MS DOS
-            "win95": {
-                "company": "MicroSoft",
-                "name": "Windows 95",
-                "year": "1995",
-                "security-level": "3",
-                "security-measures": ["Passcryption 8-bit"],
-                "isa": ["Base", "IO", "SysCall", "32-bit Ext"],
-                "weakness": [
-                    "Buffer Overflow",
-                    "Password 8-bit",
-                    "No Limit Password",
-                    "Disk Unencrypted",
-                ],
-                "owner": "Jeremy C.",
-            },  # Windows 95
-            "osx": {
-                "company": "Apple Inc.",
-                "name": "Mac OS X",
-                "year": "2001",
-                "security-level": "3",
-                "security-measures": ["iPassword 32-bit", "iPhoneUnlock 1.0"],
-                "isa": ["Base", "IO", "SysCall", "32-bit Ext", "DualCore"],
-                "weakness": [
-                    "iPhoneUnlock Immitation",
-                    "DualCore Race Condition",
-                    "FBI Backdoor",
-                ],
-                "owner": "Quill's Macintosh",
-            },  # OS X
-            "windows": {
-                "company": "MicroSoft",
-                "name": "Windows 10",
-                "year": "2015",
-                "security-level": "6",
-                "security-measures": [
-                    "Wincrypt AES",
-                    "Windows Hello",
-                    "FingerLock 1.0 (TM)",
-                    "DiscCrypt32",
-                ],
-                "isa": ["Base", "IO", "SysCall", "64-bit Ext", "OctaCore"],
-                "weakness": [
-                    "Malformed URL",
-                    "Memory Leaks",
-                    "FBI Backdoor",
-                    "Scammers",
-                    "Common Passwords",
-                ],
-                "owner": "Albert",
-            },  # Windows 10
-            "freebsd": {
-                "company": "Community",
-                "name": "FreeBSD 12",
-                "year": "2018",
-                "security-level": "7",
-                "security-measures": [
-                    "LibreCrypt AES64",
-                    "LibreHash256",
-                    "DNS over SSL",
-                    "Https",
-                    "BinGPG",
-                    "Firewalld",
-                ],
-                "isa": [
-                    "Base",
-                    "IO",
-                    "SysCall",
-                    "64-bit Ext",
-                    "SingleRegister",
-                    "SecureReg",
-                ],
-                "weakness": ["RegisterOverflow", "Log4j", "DDOS"],
-                "owner": "Server-CBF123D2",
-            },  # FreeBSD 12
-            "macos": {
-                "company": "Apple Inc.",
-                "name": "MacOS BigSur",
-                "year": "2020",
-                "security-level": "8",
-                "security-measures": [
-                    "Secure Enclave",
-                    "Aarch64",
-                    "AES.64",
-                    "iCrypt 3000",
-                ],
-                "isa": [
-                    "BaseT2",
-                    "BaseMathT2",
-                    "EnclaveIO",
-                    "Syscall",
-                    "Redundent Registers",
-                    "ECC Memory",
-                ],
-                "weakness": [
-                    "No Password",
-                    "EFI Partition Mounted",
-                    "Bootloader Debug Symbols",
-                ],
-                "owner": "Timmy's Mac",
-            },  # MacOS BigSur
-            "linux": {
-                "company": "Linux Foundation",
-                "name": "Linux 5.16 (Arch)",
-                "year": "2022",
-                "security-level": "10",
-                "security-measures": [
-                    "Ram Sweeper",
-                    "GPG Verify",
-                    "Time Limited Execution",
-                    "Process Monitor",
-                    "512-bit Password",
-                ],
-                "isa": [
-                    "BaseT2",
-                    "BaseMathT2",
-                    "HubIO",
-                    "Verified Syscall",
-                    "Network",
-                    "CSR",
-                    "GPU",
-                ],
-                "weakness": ["SIGKILL", "Log4j", "Ram Overload", "HDD Swapfile"],
-                "owner": "Anonymous",
-            },  # Linux 5.16
-        }
+    def build_stageselect(self):
+        if self.stageselect_built:
+            return
+        self.stage_assets.result()
         self.logo_visible_rect = pygame.Rect(
             0, 0, int(0.3 * self.height), int(0.3 * self.height)
         )
@@ -475,77 +1163,8 @@ class Game:
         )
         self.logo_visible_rect.center = (self.width // 2, self.height // 2)
         self.logo_visible_bound_rect.center = (self.width // 2, self.height // 2)
-        self.current_logo_index = 0
-        self.logo_frames = []
 
-        self.info_text = self.text_renderer.render(gm("OS Info"), aa, (255, 255, 255))
-        self.target_environment = self.text_renderer.render(
-            gm("Target"), aa, (255, 255, 255)
-        )
-        self.target_environment_rect = self.target_environment.get_rect()
-        self.target_environment_rect.topright = (self.width - 10, 10)
-
-        for (
-            i,
-            x,
-        ) in (
-            self.logo_information.items()
-        ):  # Render static components of stageselect to convert CPU consumption to RAM consumption
-            frame = pygame.Surface((self.width, self.height))
-            frame.fill((0, 0, 0))
-            frame.blit(self.logos[i], self.logo_visible_rect)
-            pygame.draw.rect(frame, (255, 255, 255), self.logo_visible_bound_rect, 1)
-            info = x
-            info["owner"] = Label(
-                info["owner"],
-                self.text_renderer,
-                invis_width=self.width,
-                dest=(0, self.logo_visible_bound_rect.top - self.ppcm + 20),
-            )
-            nl = "\n    * "
-            info_to_show = f"""{gm("Company")}: {info["company"]}
-{gm("Release")}: {info["year"]}
-{gm("Name")}: {info["name"]}
-
-{gm("Security Level")}: [{('='*int(info["security-level"])).ljust(10)}]
-{gm("Security Measures")}:{nl+nl.join(info["security-measures"])}"""
-            info2 = f"""ISA: {nl+nl.join(info["isa"])}
-
-{gm("Weakness")}: {nl+nl.join(info["weakness"])}"""
-            info2 = info2.splitlines()
-            surf2 = pygame.Surface((self.width, self.height))
-            info_to_show = info_to_show.splitlines()
-            h = 20
-            max_w = 0
-            for line in info_to_show:
-                surf = self.text_rendererh2.render(
-                    line,
-                    aa,
-                    (255, 255, 255),
-                )
-                frame.blit(surf, (20, h + self.ppcm + 10))
-                h += surf.get_height()
-                max_w = max(max_w, surf.get_width())
-            max_w += 20
-            info_rect = pygame.Rect(10, 20 + self.ppcm, max_w, h)
-            pygame.draw.rect(frame, (255, 255, 255), info_rect, 1)
-            h = 0
-            max_w = 0
-            for line in info2:
-                surf = self.text_rendererh2.render(line, aa, (255, 255, 255))
-                surf2.blit(surf, (0, h))
-                h += surf.get_height()
-                max_w = max(max_w, surf.get_width())
-            info2_rect = pygame.Rect(
-                self.width - max_w - 30, 20 + self.ppcm, max_w + 20, h + 20
-            )
-            info2_dest = pygame.Rect(self.width - max_w - 20, 30 + self.ppcm, 0, 0)
-            frame.blit(surf2, info2_dest)
-            pygame.draw.rect(frame, (255, 255, 255), info2_rect, 1)
-            frame.blit(self.info_text, (10, 10))
-            frame.blit(self.target_environment, self.target_environment_rect)
-
-            self.logo_frames.append(frame)
+        self.render_stageselect_titles()
 
         self.unknown_owner = Label(
             "???",
@@ -554,8 +1173,12 @@ class Game:
             dest=(0, self.logo_visible_bound_rect.top - self.ppcm + 20),
         )
         # Stageselect Controls notifier
-        self.controls_text = self.text_renderer.render("<-", aa, (255, 255, 255))
-        self.controls_text2 = self.text_renderer.render("->", aa, (255, 255, 255))
+        self.controls_text = text_cache.render(
+            self.text_renderer, "<-", aa, (255, 255, 255)
+        )
+        self.controls_text2 = text_cache.render(
+            self.text_renderer, "->", aa, (255, 255, 255)
+        )
         self.controls_text2_rect = self.controls_text2.get_rect()
         self.controls_text2_rect.bottomright = (self.width - 10, self.height - 10)
         self.controls_text_rect = self.controls_text.get_rect()
@@ -566,10 +1189,10 @@ class Game:
 
         # Stageselect back to main menu
         def evt_main_menu():
-            self.scene = "mainmenu"
+            self.switch_scene("mainmenu")
 
         def evt_levelsel():  # TODO Make enter button
-            self.scene = "levelsel"
+            self.enter_stage()
 
         self.stageselect_back = TextButton(
             gm("Back"),
@@ -596,7 +1219,7 @@ class Game:
 
         # Levelsel (LevelSelect specific stuff)
         def evt_stage_select():
-            self.scene = "stageselect"
+            self.switch_scene("stageselect")
 
         self.levelsel_back = TextButton(
             gm("Back"),
@@ -608,24 +1231,81 @@ class Game:
             bottom_aligned=True,
             event=evt_stage_select,
         )
+        self.stageselect_built = True
 
-        # End of loading
-        time.sleep(2)
-        pygame.mixer.music.pause()
-        pygame.mixer.music.load("assets/music/startup_end.mp3")
-        pygame.mixer.music.play()
-        while pygame.mixer.music.get_busy():
-            time.sleep(0.1)
-        pygame.mixer.music.unload()
+    def render_stageselect_titles(self):
+        self.info_text = text_cache.render(
+            self.text_renderer, gm("OS Info"), aa, (255, 255, 255)
+        )
+        self.target_environment = text_cache.render(
+            self.text_renderer, gm("Target"), aa, (255, 255, 255)
+        )
+        self.target_environment_rect = self.target_environment.get_rect()
+        self.target_environment_rect.topright = (self.width - 10, 10)
+
+    def set_language(self, new_lang: str):
+        """
+        Switches language in place. Only text looked up through `gm` is
+        rendered again: translated widgets, the stageselect titles and the
+        cached stage frames, which are redrawn on demand.
+        """
+        global lang
+        lang = new_lang
+        reload()
+        for scene in self.scenes.values():
+            if scene.name != "mainmenu" and not self.stageselect_built:
+                continue
+            for widget in scene.widgets():
+                widget.retranslate()
+        if self.stageselect_built:
+            self.render_stageselect_titles()
+            self.stage_frames.clear()
+            if self.active_scene.name == "stageselect":
+                self.prefetch_stage_frames(include_current=True)
+        self.grid_key = None  # widget rectangles may have moved
+        self.drawn_state = None
+
+    def boot(self):
+        """
+        Animates the boot screen and pumps events until the main menu's
+        assets are loaded, then plays the end of the startup jingle with
+        the background music queued after it.
+        """
+        frame = 0
+        while not self.menu_assets.done():
+            for x in pygame.event.get():
+                if x.type == pygame.QUIT:
+                    self.running = False
+            if not self.running:
+                return
+            self.window.fill((0, 0, 0), self.boot_rect.inflate(self.width, 0))
+            self.window.blit(
+                self.boot_frames[(frame // (self.fps // 4 or 1)) % 4], self.boot_rect
+            )
+            pygame.display.update(self.boot_rect.inflate(self.width, 0))
+            self.audio.update()
+            frame += 1
+            self.clock.tick(self.fps)
+        self.menu_assets.result()  # re-raises loader errors
+        self.build_mainmenu()
+        self.audio.play("assets/music/startup_end.mp3", fade_ms=100)
+        self.audio.queue(
+            "assets/music/background_retro_art_music.mp3", loops=-1, fade_ms=500
+        )
 
     def start(self):
-        pygame.mixer.music.load("assets/music/background_retro_art_music.mp3")
-        pygame.mixer.music.play(-1)
         pygame.mouse.set_visible(False)
 
         self.running = True
+        self.boot()
         while self.running:
-            self.window.fill((0, 0, 0))
+            profiler = self.profiler
+            profiler.begin()
+            if self.time_to_interactive is None:
+                self.time_to_interactive = time.perf_counter() - LAUNCHED
+                profiler.time_to_interactive = self.time_to_interactive
+            if not self.stageselect_built and self.stage_assets.done():
+                self.build_stageselect()
             for x in pygame.event.get():
                 if x.type == pygame.QUIT:
                     self.running = False
@@ -634,18 +1314,16 @@ class Game:
                         x.key == pygame.K_q and pygame.key.get_mods() & pygame.KMOD_CTRL
                     ):  # Ctrl-Q
                         self.running = False
-                    if x.key == pygame.K_RIGHT and self.scene == "stageselect":
-                        self.current_logo_index += 1
-                        if self.current_logo_index == len(self.logos):
-                            self.current_logo_index = 0
-                    if x.key == pygame.K_LEFT and self.scene == "stageselect":
-                        self.current_logo_index -= 1
-                        if self.current_logo_index < 0:
-                            self.current_logo_index = len(self.logos) - 1
-                    if (
-                        x.key == pygame.K_RETURN or x.key == pygame.K_KP_ENTER
-                    ) and self.scene == "stageselect":
-                        self.scene = "levelsel"
+                    elif x.key == pygame.K_F3:
+                        self.show_profiler = not self.show_profiler
+                    elif x.key == pygame.K_F4:
+                        profiler.dump(time.strftime("profile-%Y%m%d-%H%M%S.csv"))
+                    elif x.key == pygame.K_F2:  # cycles through languages
+                        available = i18n.languages()
+                        tag = i18n.fallbacks(lang)[0]
+                        index = available.index(tag) if tag in available else -1
+                        self.set_language(available[(index + 1) % len(available)])
+                    self.active_scene.key_up(x.key)
                 elif x.type == pygame.MOUSEMOTION:
                     x, y = x.pos
                     self.handle_hover(x, y)
@@ -657,89 +1335,299 @@ class Game:
                     x, y = x.pos
                     self.cursor_state = "down"
                     self.handle_mouse(x, y, True)
+            self.audio.update()
+            profiler.lap("events")
+            if self.watchdog is not None and not self.watchdog.finished:
+                profiler.steps = self.watchdog.tick()
+                machine = self.watchdog.machine
+                if machine.halted and machine.fault is None:
+                    self.gamesave.record_result(
+                        self.logo_names[self.current_logo_index], machine.steps
+                    )
+            profiler.lap("vm")
             self.cursor_pos = (
                 pygame.mouse.get_pos()[0] - self.cursor[0].get_height() // 2,
                 pygame.mouse.get_pos()[1] - self.cursor[0].get_width() // 2,
             )
             self.clock.tick(self.fps)
-            self.render()
-            self.window.blit(
-                self.cursor[self.cursor_name.index(self.cursor_state)], self.cursor_pos
-            )
-            pygame.display.update()
+            profiler.lap("wait")
+            if self.dirty_rects:
+                self.present_dirty()
+            else:
+                self.window.fill((0, 0, 0))
+                self.render(self.window)
+                if self.show_profiler:
+                    self.draw_profiler()
+                profiler.lap("render")
+                self.window.blit(
+                    self.cursor[self.cursor_name.index(self.cursor_state)],
+                    self.cursor_pos,
+                )
+                profiler.lap("cursor")
+                pygame.display.update()
+                profiler.lap("update")
+            profiler.end()
+        self.prefetcher.shutdown(cancel_futures=True)
+        self.loader.shutdown(cancel_futures=True)
+        self.audio.shutdown()
+        self.gamesave.close()
         pygame.quit()
 
-    def render(self):
-        if self.scene == "mainmenu":
-            self.render_mainmenu_frame()
-        elif self.scene == "stageselect":
-            self.render_stageselect_frame()
-        elif self.scene == "levelsel":
-            self.render_levelselect_frame()
+    @property
+    def scene(self) -> str:
+        return self.active_scene.name
+
+    def switch_scene(self, name: str):
+        self.active_scene.exit()
+        self.active_scene = self.scenes[name]
+        self.active_scene.enter()
+
+    def present_dirty(self):
+        """
+        Pushes only changed regions to the display: widgets whose look
+        changed and the old and new cursor rectangles. Anything that
+        changes the scene as a whole (scene, selected stage, unlocks)
+        redraws the full canvas.
+        """
+        cursor = self.cursor[self.cursor_name.index(self.cursor_state)]
+        cursor_rect = cursor.get_rect(topleft=self.cursor_pos)
+        state = (self.active_scene, self.active_scene.state())
+        rects = []
+        if state != self.drawn_state:
+            for widget in self.active_scene.widgets():
+                widget.dirty = False
+            self.canvas.fill((0, 0, 0))
+            self.render(self.canvas)
+            self.window.blit(self.canvas, (0, 0))
+            rects.append(self.window.get_rect())
+            self.drawn_state = state
+        else:
+            for widget in self.active_scene.widgets():
+                if widget.dirty:
+                    widget.dirty = False
+                    rects.append(widget.outer_rect.copy())
+            rects += self.active_scene.animated_rects()
+            for rect in rects:
+                self.canvas.set_clip(rect)
+                self.canvas.fill((0, 0, 0))
+                self.render(self.canvas)
+            self.canvas.set_clip(None)
+            if (cursor, cursor_rect) != self.drawn_cursor:
+                if self.drawn_cursor is not None:
+                    rects.append(self.drawn_cursor[1])
+                rects.append(cursor_rect)
+            for rect in rects:
+                self.window.blit(self.canvas, rect, rect)
+        if self.show_profiler:
+            rects.append(self.draw_profiler())
+        elif self.profiler_drawn:
+            rect = self.profiler_rect()
+            self.window.blit(self.canvas, rect, rect)
+            rects.append(rect)
+        self.profiler_drawn = self.show_profiler
+        self.profiler.lap("render")
+        if rects:
+            self.window.blit(cursor, cursor_rect)
+            self.profiler.lap("cursor")
+            pygame.display.update(rects)
+            self.profiler.lap("update")
+        self.drawn_cursor = (cursor, cursor_rect)
+
+    def profiler_rect(self) -> pygame.Rect:
+        rect = pygame.Rect(0, 0, min(300, self.width // 2), min(120, self.height // 3))
+        rect.topright = (self.width - 10, 10)
+        return rect
+
+    def draw_profiler(self) -> pygame.Rect:
+        rect = self.profiler_rect()
+        atlas = text_cache.atlas(self.text_rendererh2, (255, 255, 255), aa)
+        self.profiler.draw(self.window, rect, atlas)
+        return rect
+
+    def enter_stage(self):
+        self.stage = self.stages.stage(self.logo_names[self.current_logo_index])
+        # Opcode tables for this exact ISA combination, cached across visits
+        self.stage_isa = vm.instruction_set(self.stage["isa"])
+        self.switch_scene("levelsel")
+
+    def run_program(self, source: str):
+        """
+        Starts a player program on the current stage. It runs a slice per
+        frame in `start` and is killed once it passes the stage's limit.
+        """
+        program = vm.assemble(source, self.stage_isa)
+        self.gamesave.record_run(self.stage["id"], source)
+        if self.stage_isa.cores > 1:
+            machine = vm.MultiCore(program, jit=True)
+        else:
+            machine = vm.VM(program, jit=True)
+        limit = STEP_LIMIT
+        if "Time Limited Execution" in self.stage["security-measures"]:
+            limit = TIME_LIMITED_STEP_LIMIT
+        self.watchdog = vm.Watchdog(machine, limit=limit, frame_seconds=0.5 / self.fps)
+
+    def render(self, surf: pygame.Surface):
+        self.active_scene.render(surf)
+
+    def widget_grid(self) -> "WidgetGrid":
+        """
+        Grid of the widgets that currently take pointer events, rebuilt only
+        when the scene or the set of active widgets changes.
+        """
+        widgets = self.active_scene.interactive_widgets()
+        key = (self.active_scene, len(widgets))
+        if key != self.grid_key:
+            for widget in self.hovered:
+                widget.mouse_leave()
+            self.hovered = []
+            self.grid = WidgetGrid(widgets)
+            self.grid_key = key
+        return self.grid
 
     def handle_mouse(self, x, y, down):
-        if self.scene == "mainmenu":
-            for v in self.mainmenu_buttons.values():
-                v.mouse_button(x, y, down)
-        elif self.scene == "stageselect":
-            self.stageselect_back.mouse_button(x, y, down)
-            if (
-                self.current_logo_index <= self.gamesave.unlock_level
-                and self.logo_visible_bound_rect.collidepoint(x, y)
-            ):
-                self.scene = "levelsel"
-            if self.current_logo_index <= self.gamesave.unlock_level:
-                self.stageselect_enter.mouse_button(x, y, down)
-            if not down and self.controls_text_rect.collidepoint(x, y):
-                self.current_logo_index -= 1
-                if self.current_logo_index < 0:
-                    self.current_logo_index = len(self.logos) - 1
-            if not down and self.controls_text2_rect.collidepoint(x, y):
-                self.current_logo_index += 1
-                if self.current_logo_index == len(self.logos):
-                    self.current_logo_index = 0
-        elif self.scene == "levelsel":
-            self.levelsel_back.mouse_button(x, y, down)
+        scene = self.active_scene  # a button below may switch it
+        self.mouse_down = down
+        self.handle_hover(x, y)
+        grid = self.grid
+        # Widgets still holding a press elsewhere need the release too
+        targets = self.hovered + [
+            w for w in grid.widgets if w.mouse_down and w not in self.hovered
+        ]
+        for widget in targets:
+            widget.mouse_button(x, y, down)
+        scene.mouse_button(x, y, down)
 
     def handle_hover(self, x, y):
-        if self.scene == "mainmenu":
-            for v in self.mainmenu_buttons.values():
-                v.mouse_hover(x, y)
-        elif self.scene == "stageselect":
-            self.stageselect_back.mouse_hover(x, y)
-            self.stageselect_enter.mouse_hover(x, y)
-        elif self.scene == "levelsel":
-            self.levelsel_back.mouse_hover(x, y)
-
-    def render_stageselect_frame(self):
-        self.window.blit(self.logo_frames[self.current_logo_index], (0, 0))
-        self.window.blit(self.controls_text, self.controls_text_rect)
-        self.window.blit(self.controls_text2, self.controls_text2_rect)
-        if self.gamesave.unlock_level < self.current_logo_index:
-            self.unknown_owner.render(self.window)
-            self.window.blit(self.logo_locked, self.logo_visible_rect)
-        else:
-            self.logo_information[self.logo_names[self.current_logo_index]][
-                "owner"
-            ].render(self.window)
-            self.stageselect_enter.render(self.window)
-        self.stageselect_back.render(self.window)
+        """Sends enter and leave events to widgets the pointer crossed."""
+        under = self.widget_grid().at(x, y)
+        for widget in self.hovered:
+            if widget not in under:
+                widget.mouse_leave()
+        for widget in under:
+            if widget not in self.hovered:
+                widget.mouse_enter(self.mouse_down)
+        self.hovered = under
+
+    def render_stage_frame(self, i: str) -> pygame.Surface:
+        """Renders the static components of a stage in stageselect."""
+        frame = pygame.Surface((self.width, self.height))
+        frame.fill((0, 0, 0))
+        frame.blit(self.stage_logo(i), self.logo_visible_rect)
+        pygame.draw.rect(frame, (255, 255, 255), self.logo_visible_bound_rect, 1)
+        info = self.stages.stage(i)
+        nl = "\n    * "
+        info_to_show = f"""{gm("Company")}: {info["company"]}
+{gm("Release")}: {info["year"]}
+{gm("Name")}: {info["name"]}
 
-    def render_levelselect_frame(self):
-        self.levelsel_back.render(self.window)
+{gm("Security Level")}: [{('='*int(info["security-level"])).ljust(10)}]
+{gm("Security Measures")}:{nl+nl.join(info["security-measures"])}"""
+        info2 = f"""ISA: {nl+nl.join(info["isa"])}
 
-    def render_mainmenu_frame(self):
-        for v in self.mainmenu_buttons.values():
-            v.render(self.window)
-        self.window.blit(self.version_text, self.version_text_rect)
+{gm("Weakness")}: {nl+nl.join(info["weakness"])}"""
+        info2 = info2.splitlines()
+        surf2 = pygame.Surface((self.width, self.height))
+        info_to_show = info_to_show.splitlines()
+        h = 20
+        max_w = 0
+        for line in info_to_show:
+            surf = text_cache.render(
+                self.text_rendererh2,
+                line,
+                aa,
+                (255, 255, 255),
+            )
+            frame.blit(surf, (20, h + self.ppcm + 10))
+            h += surf.get_height()
+            max_w = max(max_w, surf.get_width())
+        max_w += 20
+        info_rect = pygame.Rect(10, 20 + self.ppcm, max_w, h)
+        pygame.draw.rect(frame, (255, 255, 255), info_rect, 1)
+        h = 0
+        max_w = 0
+        for line in info2:
+            surf = text_cache.render(self.text_rendererh2, line, aa, (255, 255, 255))
+            surf2.blit(surf, (0, h))
+            h += surf.get_height()
+            max_w = max(max_w, surf.get_width())
+        info2_rect = pygame.Rect(
+            self.width - max_w - 30, 20 + self.ppcm, max_w + 20, h + 20
+        )
+        info2_dest = pygame.Rect(self.width - max_w - 20, 30 + self.ppcm, 0, 0)
+        frame.blit(surf2, info2_dest)
+        pygame.draw.rect(frame, (255, 255, 255), info2_rect, 1)
+        frame.blit(self.info_text, (10, 10))
+        frame.blit(self.target_environment, self.target_environment_rect)
+        return frame
+
+    def stage_frame(self, index: int) -> pygame.Surface:
+        name = self.logo_names[index]
+        frame = self.stage_frames.get(name)
+        if frame is None:
+            with self.stage_frame_lock:  # render each stage only once
+                frame = self.stage_frames.get(name)
+                if frame is None:
+                    frame = self.render_stage_frame(name)
+                    self.stage_frames.put(name, frame)
+        return frame
+
+    def prefetch_stage_frames(self, include_current: bool = False):
+        n = len(self.logo_names)
+        indices = [self.current_logo_index + 1, self.current_logo_index - 1]
+        if include_current:
+            indices.insert(0, self.current_logo_index)
+        for index in indices:
+            name = self.logo_names[index % n]
+            if name in self.stage_frames or name in self.prefetching:
+                continue
+            self.prefetching.add(name)
+            self.prefetcher.submit(self._prefetch_stage_frame, index % n)
+
+    def _prefetch_stage_frame(self, index: int):
+        try:
+            self.stage_frame(index)
+        finally:
+            self.prefetching.discard(self.logo_names[index])
 
 
 def guess_font_size(ppcm: int, sample_text: str, font: str) -> int:
-    for x in range(ppcm, 0, -1):
-        r = pygame.font.Font(font, x)
-        s = r.render(sample_text, False, (255, 255, 255), (0, 0, 0))
-        if s.get_height() <= ppcm:
-            return x
+    """
+    Largest font size whose line height fits in `ppcm` pixels. Found by
+    bisection on font metrics (no rendering) and remembered on disk per
+    font file contents, ppcm and sample text.
+    """
+    with open(font, "rb") as file:
+        key = f"{hashlib.sha1(file.read()).hexdigest()}:{ppcm}:{sample_text}"
+    cache_file = CONFIG_DIR + "/fontsizes.json"
+    try:
+        with open(cache_file) as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        cache = {}
+    if key in cache:
+        return cache[key]
+
+    best = None
+    lo, hi = 1, ppcm
+    while lo <= hi:
+        x = (lo + hi) // 2
+        with font_lock:
+            height = pygame.font.Font(font, x).size(sample_text)[1]
+        if height <= ppcm:
+            best = x
+            lo = x + 1
+        else:
+            hi = x - 1
+
+    cache[key] = best
+    try:
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        with open(cache_file + ".tmp", "w") as file:
+            json.dump(cache, file)
+        os.replace(cache_file + ".tmp", cache_file)
+    except OSError:
+        pass  # only a cache
+    return best
 
 
 def main():
@@ -767,6 +1655,7 @@ def main():
         settings["font"]["ppcm"],
         settings["font"]["font"],
         settings["font"]["antialias"],
+        settings["window"].get("dirty_rects", True),
     )
     game.start()
 
@@ -0,0 +1,97 @@
+"""
+Locale catalogues.
+
+Translations live in `assets/locales/<language>/<variant>.json`. A
+language tag like `en-gb` falls back to `en-base` and then to the key
+itself, so a missing string shows its English key instead of crashing.
+
+A catalogue is only read when it is first used. Its fallback chain is
+then flattened into one table and kept in the cache directory with
+`marshalcache`, so later runs load a single compact file.
+"""
+
+import functools
+import json
+import os
+from typing import Dict, List, Optional
+
+import marshalcache
+
+ROOT = "assets/locales"
+FORMAT = 1  # bump when the compiled layout changes
+
+
+class Message(str):
+    """A translated string that remembers the key it was looked up by."""
+
+    key: str
+
+
+def fallbacks(lang: str) -> List[str]:
+    """`en-gb` -> `["en-gb", "en-base"]`, `hi` -> `["hi-base"]`."""
+    language, _, variant = lang.partition("-")
+    chain = [f"{language}-{variant or 'base'}"]
+    if variant and variant != "base":
+        chain.append(f"{language}-base")
+    return chain
+
+
+def languages(root: str = ROOT) -> List[str]:
+    """Every `language-variant` with a catalogue under `root`."""
+    found = []
+    for language in sorted(os.listdir(root)):
+        if os.path.isdir(f"{root}/{language}"):
+            found += [
+                f"{language}-{os.path.splitext(file)[0]}"
+                for file in sorted(os.listdir(f"{root}/{language}"))
+                if file.endswith(".json")
+            ]
+    return found
+
+
+class Catalogue:
+    def __init__(self, lang: str, root: str = ROOT, cache_dir: str = None):
+        self.lang = lang
+        self.root = root
+        self.cache_dir = cache_dir
+        self.chain = fallbacks(lang)
+        self._table: Optional[Dict[str, str]] = None
+
+    def sources(self) -> List[str]:
+        return [
+            f"{self.root}/{tag.replace('-', '/', 1)}.json"
+            for tag in self.chain
+            if os.path.exists(f"{self.root}/{tag.replace('-', '/', 1)}.json")
+        ]
+
+    @property
+    def table(self) -> Dict[str, str]:
+        if self._table is None:
+            self._table = self._load()
+        return self._table
+
+    def get(self, key: str) -> Message:
+        message = Message(self.table.get(key, key))
+        message.key = key
+        return message
+
+    def _load(self) -> Dict[str, str]:
+        sources = self.sources()
+        cache_file = self.cache_dir and f"{self.cache_dir}/{self.lang}.cat"
+
+        def build() -> Dict[str, str]:
+            table = {}
+            for path in reversed(sources):  # most specific catalogue wins
+                with open(path, encoding="utf-8") as file:
+                    table.update(json.load(file))
+            return table
+
+        return marshalcache.cached(
+            cache_file, marshalcache.file_stamp(FORMAT, sources), build
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def catalogue(lang: str, root: str = ROOT, cache_dir: str = None) -> Catalogue:
+    """The catalogue of `lang`, shared between callers and loaded lazily."""
+    return Catalogue(lang, root, cache_dir)
@@ -0,0 +1,49 @@
+"""
+Derived data kept on disk with `marshal`.
+
+The locale catalogues and the stage index are both cheap to rebuild from
+their sources but read on every start, so they are written to the cache
+directory next to a stamp of the size and modification time of every
+source file. A cache whose stamp does not match, or that cannot be read
+at all, is rebuilt; failing to write one only costs the next start.
+"""
+
+import marshal
+import os
+from typing import Any, Callable, Iterable, List, Optional
+
+
+def file_stamp(format: int, sources: Iterable[str]) -> list:
+    """`format` followed by the path, size and mtime of every source."""
+    result: List[Any] = [format]
+    for path in sources:
+        stat = os.stat(path)
+        result += [path, stat.st_size, stat.st_mtime_ns]
+    return result
+
+
+def cached(cache_file: Optional[str], stamp: list, build: Callable[[], Any]):
+    """
+    The value cached in `cache_file` under `stamp`, else `build()`, which
+    is then written there. Without a `cache_file` it only calls `build`.
+    """
+    if cache_file:
+        try:
+            with open(cache_file, "rb") as file:
+                cached_stamp, value = marshal.load(file)
+            if cached_stamp == stamp:
+                return value
+        except (OSError, ValueError, EOFError, TypeError):
+            pass
+
+    value = build()
+
+    if cache_file:
+        try:
+            os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+            with open(cache_file + ".tmp", "wb") as file:
+                marshal.dump((stamp, value), file)
+            os.replace(cache_file + ".tmp", cache_file)
+        except OSError:
+            pass  # only a cache
+    return value
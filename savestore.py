@@ -0,0 +1,182 @@
+"""
+Crash safe save data.
+
+`SaveStore` keeps a dict of JSON values in memory. `set` only updates
+the dict and queues the encoded value; a background thread appends the
+queued values to `<name>.journal`, one JSON line per key, so a key
+written many times between two flushes costs a single record. Once the
+journal grows past `compact_bytes` the whole state is written to
+`<name>.json` through a temporary file and `os.replace`, and the journal
+starts over.
+
+Loading reads `<name>.json` and replays the journal over it. Records
+only ever hold whole values, so replaying one twice is harmless, and a
+line torn by a crash in the middle of an append is skipped.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+_DELETED = object()
+
+
+class SaveStore:
+    def __init__(
+        self,
+        directory: str,
+        name: str = "save",
+        delay: float = 0.5,
+        compact_bytes: int = 256 * 1024,
+    ):
+        self.path = f"{directory}/{name}.json"
+        self.journal_path = f"{directory}/{name}.journal"
+        self.delay = delay  # seconds writes are held back to coalesce them
+        self.compact_bytes = compact_bytes
+        self.error: Optional[OSError] = None  # of the last failed write
+        self.torn = False  # the journal ends in the middle of a line
+        os.makedirs(directory, exist_ok=True)
+        self.data: Dict[str, Any] = self._load()
+        # JSON text of every value as of its last `set`, what gets written
+        self.encoded = {key: json.dumps(value) for key, value in self.data.items()}
+        self.pending: Dict[str, Any] = {}  # key -> JSON text or _DELETED
+        self.writing = False
+        self.urgent = False  # someone waits in `flush`
+        self.closed = False
+        self.condition = threading.Condition()
+        self.journal = open(self.journal_path, "a", encoding="utf-8")
+        self.journal_size = self.journal.tell()
+        self.writer = threading.Thread(
+            target=self._write_loop, name=f"save {name}", daemon=True
+        )
+        self.writer.start()
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            data = {}
+        try:
+            with open(self.journal_path, encoding="utf-8") as file:
+                for line in file:
+                    self.torn = not line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn by a crash while appending
+                    if "value" in record:
+                        data[record["key"]] = record["value"]
+                    else:
+                        data.pop(record["key"], None)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key: str, value):
+        """Stores `value`, written to disk later by the writer thread."""
+        text = json.dumps(value)  # a snapshot, callers may keep mutating
+        with self.condition:
+            self.data[key] = value
+            self.encoded[key] = text
+            self.pending[key] = text
+            self.condition.notify()
+
+    def delete(self, key: str):
+        with self.condition:
+            self.data.pop(key, None)
+            self.encoded.pop(key, None)
+            self.pending[key] = _DELETED
+            self.condition.notify()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Waits until every change so far is on disk, False if `timeout`
+        seconds passed first.
+        """
+        with self.condition:
+            self.urgent = True
+            self.condition.notify_all()
+            return self.condition.wait_for(
+                lambda: not (self.pending or self.writing) or self.closed, timeout
+            )
+
+    def close(self):
+        """Writes everything still pending, compacts and stops the writer."""
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.writer.join()
+        self.journal.close()
+
+    def _write_loop(self):
+        condition = self.condition
+        while True:
+            with condition:
+                condition.wait_for(lambda: self.pending or self.closed)
+                # give the game a moment to overwrite the same keys
+                condition.wait_for(lambda: self.urgent or self.closed, self.delay)
+                pending, self.pending = self.pending, {}
+                self.urgent = False
+                self.writing = True
+                closed = self.closed
+            try:
+                self._append(pending)
+                if self.journal_size and (
+                    closed or self.journal_size >= self.compact_bytes
+                ):
+                    self._compact()
+                self.error = None
+            except OSError as e:
+                self.error = e
+                self.torn = True  # an append may have stopped half way
+                with condition:
+                    # retried with the next write, newer values win
+                    self.pending = {**pending, **self.pending}
+            with condition:
+                self.writing = False
+                condition.notify_all()
+                if closed:
+                    return
+            if self.error is not None:
+                with condition:
+                    condition.wait(self.delay)
+
+    def _append(self, pending: Dict[str, Any]):
+        if not pending:
+            return
+        lines = []
+        for key, text in pending.items():
+            if text is _DELETED:
+                lines.append(json.dumps({"key": key}) + "\n")
+            else:
+                lines.append(f'{{"key": {json.dumps(key)}, "value": {text}}}\n')
+        if self.torn:
+            lines.insert(0, "\n")  # keep the first record off the torn line
+        self.journal.write("".join(lines))
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.journal_size = self.journal.tell()
+        self.torn = False
+
+    def _compact(self):
+        with self.condition:
+            text = ", ".join(
+                f"{json.dumps(key)}: {value}" for key, value in self.encoded.items()
+            )
+        with open(self.path + ".tmp", "w", encoding="utf-8") as file:
+            file.write("{" + text + "}")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        # a crash before the truncate only replays records already in the
+        # new snapshot
+        self.journal.truncate(0)
+        self.journal.seek(0)
+        self.journal_size = 0
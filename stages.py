@@ -0,0 +1,117 @@
+"""
+Stage catalogue.
+
+Stages come in packs, `assets/stages/<pack>.jsonl` files holding the full
+definition of one stage per line: the details shown on the stage select
+screen, its `isa`, the `logo` frame and, once a stage has them, its
+levels and test vectors in the format of `verify.py`. The `base` pack is
+listed first, other packs follow by name. Stage ids are unique across
+all packs.
+
+Opening the catalogue only needs the index of each pack: the id and the
+byte offset and length of every line. It is built the first time a pack
+is seen and kept in the cache directory with `marshalcache`, so opening
+the catalogue is one small read per pack however many stages are
+installed. A full definition, which is what the stage select screen
+shows, is read with one seek when it is first needed and only the `keep`
+most recently used stay loaded.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+import marshalcache
+
+ROOT = "assets/stages"
+FORMAT = 2  # bump when the index layout changes
+
+
+class Entry:
+    """Where a stage is defined, known without reading its definition."""
+
+    def __init__(self, id: str, path: str, offset: int, length: int):
+        self.id = id
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+
+def packs(root: str = ROOT) -> List[str]:
+    """Stage pack files under `root`, `base` first."""
+    names = sorted(
+        os.path.splitext(file)[0]
+        for file in os.listdir(root)
+        if file.endswith(".jsonl")
+    )
+    if "base" in names:
+        names.remove("base")
+        names.insert(0, "base")
+    return [f"{root}/{name}.jsonl" for name in names]
+
+
+def build_index(path: str) -> list:
+    """`(id, offset, length)` per stage."""
+    rows = []
+    offset = 0
+    with open(path, "rb") as file:
+        for line in file:
+            if line.strip():
+                rows.append((json.loads(line)["id"], offset, len(line)))
+            offset += len(line)
+    return rows
+
+
+class Catalogue:
+    def __init__(self, root: str = ROOT, cache_dir: str = None, keep: int = 16):
+        self.root = root
+        self.cache_dir = cache_dir
+        self.keep = keep
+        self.entries: List[Entry] = []
+        self.positions: Dict[str, int] = {}
+        for path in packs(root):
+            for id, offset, length in self._index(path):
+                if id in self.positions:
+                    first = self.entries[self.positions[id]].path
+                    raise ValueError(f"stage {id!r} is defined in {first} and {path}")
+                self.positions[id] = len(self.entries)
+                self.entries.append(Entry(id, path, offset, length))
+        self.definitions: "OrderedDict[str, dict]" = OrderedDict()
+        self.lock = threading.Lock()  # stage frames are rendered off thread
+
+    def __len__(self):
+        return len(self.entries)
+
+    def ids(self) -> List[str]:
+        return [entry.id for entry in self.entries]
+
+    def entry(self, id: str) -> Entry:
+        return self.entries[self.positions[id]]
+
+    def stage(self, id: str) -> Dict:
+        """The full definition of stage `id`, read from its pack on first use."""
+        with self.lock:
+            definition = self.definitions.get(id)
+            if definition is not None:
+                self.definitions.move_to_end(id)
+                return definition
+        entry = self.entry(id)
+        with open(entry.path, "rb") as file:
+            file.seek(entry.offset)
+            definition = json.loads(file.read(entry.length))
+        with self.lock:
+            self.definitions[id] = definition
+            while len(self.definitions) > self.keep:
+                self.definitions.popitem(last=False)
+        return definition
+
+    def _index(self, path: str) -> list:
+        name = os.path.splitext(os.path.basename(path))[0]
+        cache_file = self.cache_dir and f"{self.cache_dir}/{name}.idx"
+        return marshalcache.cached(
+            cache_file,
+            marshalcache.file_stamp(FORMAT, [path]),
+            lambda: build_index(path),
+        )
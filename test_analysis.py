@@ -0,0 +1,81 @@
+"""
+Differential checks of `analysis`: random programs must end with the
+same registers, memory, output and fault message after `optimize`, and
+`IncrementalAnalyzer` must agree with assembling the edited source anew.
+
+    python -m pytest test_analysis.py
+"""
+
+import random
+
+import analysis
+import vm
+from testutil import end_state, random_program
+
+ISA = vm.instruction_set(["BaseMathT2", "IO"])
+
+
+def outcome(program: vm.Program, inputs) -> dict:
+    """The end state, without what depends on instruction positions."""
+    machine = vm.VM(program, 64, inputs)
+    machine.run(5000)
+    state = end_state(machine)
+    del state["pc"]
+    state["fault"] = state["fault"] and state["fault"].rsplit(" (", 1)[0]
+    return state
+
+
+def test_optimize_matches_interpreter():
+    rng = random.Random(0)
+    checked = 0
+    while checked < 1000:
+        source = random_program(rng, ISA, rng.randint(1, 25), registers=4)
+        program = vm.assemble(source, ISA)
+        inputs = [rng.randrange(100) for _ in range(5)]
+        expected = outcome(program, inputs)
+        if not expected["halted"]:
+            continue  # fewer steps per iteration would end elsewhere
+        got = outcome(analysis.optimize(program), inputs)
+        assert got.pop("steps") <= expected.pop("steps"), source
+        assert got == expected, source
+        checked += 1
+
+
+def test_registers_survive_faults():
+    program = vm.assemble("mov a1 5\ndiv a2 a2 a0\nmov a1 6\nhalt")
+    got = outcome(analysis.optimize(program), [])
+    expected = outcome(program, [])
+    assert got.pop("steps") <= expected.pop("steps")
+    assert got == expected
+
+
+def random_lines(rng: random.Random) -> list:
+    """Random source lines, with broken ones and labels defined twice or never."""
+    lines = random_program(rng, ISA, rng.randint(0, 6), registers=4, labels=2)
+    lines = lines.splitlines()
+    for _ in range(rng.randint(0, 2)):
+        extra = rng.choice(["#l0", "#l5", "jump l5", "add a0", "bogus a1", "", "  "])
+        lines.insert(rng.randint(0, len(lines)), extra)
+    return lines
+
+
+def test_incremental_matches_full_assembly():
+    rng = random.Random(0)
+    for _ in range(50):
+        lines = random_lines(rng)
+        analyzer = analysis.IncrementalAnalyzer("\n".join(lines), ISA)
+        for _ in range(30):
+            start = rng.randint(0, len(lines))
+            end = rng.randint(start, min(len(lines), start + 3))
+            new_lines = random_lines(rng)[: rng.randint(0, 3)]
+            lines[start:end] = new_lines
+            if rng.random() < 0.5:
+                analyzer.replace(start, end, new_lines)
+            else:
+                lines = "\n".join(lines).splitlines()  # drops a last empty line
+                analyzer.set_source("\n".join(lines))
+            program, errors = vm.assemble_lines(lines, ISA)
+            assert analyzer.lines == lines
+            assert analyzer.labels() == program.label_lines
+            assert analyzer.errors() == errors
+            assert analyzer.structure() == analysis.structure(program, errors)
@@ -0,0 +1,85 @@
+"""
+Crash safety of `savestore.SaveStore`: what was flushed survives a kill,
+a torn journal line is skipped, compaction keeps the latest values and
+`close` writes whatever is still pending.
+
+    python -m pytest test_savestore.py
+"""
+
+import os
+import subprocess
+import sys
+
+import savestore
+
+
+def reopen(directory, **kwargs) -> dict:
+    store = savestore.SaveStore(str(directory), **kwargs)
+    data = dict(store.data)
+    store.close()
+    return data
+
+
+def test_flushed_writes_survive_a_kill(tmp_path):
+    script = (
+        "import os, sys, savestore\n"
+        "store = savestore.SaveStore(sys.argv[1])\n"
+        "store.set('level', 1)\n"
+        "store.set('runs', ['a'])\n"
+        "store.flush()\n"
+        "store.set('level', 2)\n"
+        "store.delete('runs')\n"
+        "store.flush()\n"
+        "store.set('lost', True)  # never flushed\n"
+        "os._exit(0)\n"
+    )
+    here = os.path.dirname(os.path.abspath(__file__))
+    subprocess.run([sys.executable, "-c", script, str(tmp_path)], cwd=here, check=True)
+    assert not (tmp_path / "save.json").exists()  # only the journal was written
+    assert reopen(tmp_path) == {"level": 2}
+
+
+def test_torn_journal_line_is_skipped(tmp_path):
+    store = savestore.SaveStore(str(tmp_path))
+    store.set("a", 1)
+    store.set("b", [1, 2, 3])
+    store.flush()
+    store.journal.close()  # as if killed before `close`
+    journal = tmp_path / "save.journal"
+    journal.write_bytes(journal.read_bytes()[:-5])
+
+    store = savestore.SaveStore(str(tmp_path))
+    assert store.torn
+    assert store.data == {"a": 1}
+    store.set("c", 3)  # must not be glued to the torn line
+    store.flush()
+    store.journal.close()
+    expected = dict(store.data)
+    assert reopen(tmp_path) == expected
+
+
+def test_compaction_keeps_latest_values(tmp_path):
+    store = savestore.SaveStore(str(tmp_path), delay=0, compact_bytes=64)
+    for i in range(50):
+        store.set("count", i)
+        store.set(f"key{i % 5}", {"i": i})
+        if i % 7 == 0:
+            store.delete("gone")
+        else:
+            store.set("gone", i)
+        store.flush()
+    expected = dict(store.data)
+    assert os.path.getsize(tmp_path / "save.journal") < 64
+    store.journal.close()  # as if killed before `close`
+    assert (tmp_path / "save.json").exists()
+    assert reopen(tmp_path) == expected
+
+
+def test_close_writes_pending_values(tmp_path):
+    store = savestore.SaveStore(str(tmp_path), delay=60)
+    store.set("a", 1)
+    store.set("a", 2)
+    store.set("b", "x")
+    store.close()
+    assert os.path.getsize(tmp_path / "save.journal") == 0  # compacted
+    assert reopen(tmp_path) == {"a": 2, "b": "x"}
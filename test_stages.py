@@ -0,0 +1,34 @@
+"""
+Stage packs: ids keep pack order, definitions come from the cached index
+and an id defined by two packs is rejected.
+
+    python -m pytest test_stages.py
+"""
+
+import json
+
+import pytest
+
+import stages
+
+
+def write_pack(root, name: str, ids):
+    lines = [json.dumps({"id": id, "owner": f"{name}/{id}"}) for id in ids]
+    (root / f"{name}.jsonl").write_text("\n".join(lines) + "\n")
+
+
+def test_packs_load_base_first(tmp_path):
+    write_pack(tmp_path, "alpha", ["c"])
+    write_pack(tmp_path, "base", ["a", "b"])
+    for _ in range(2):  # builds, then reads the cached index
+        catalogue = stages.Catalogue(str(tmp_path), str(tmp_path / "cache"))
+        assert catalogue.ids() == ["a", "b", "c"]
+        assert catalogue.stage("b")["owner"] == "base/b"
+        assert catalogue.stage("c")["owner"] == "alpha/c"
+
+
+def test_duplicate_ids_are_rejected(tmp_path):
+    write_pack(tmp_path, "base", ["a", "b"])
+    write_pack(tmp_path, "community", ["b"])
+    with pytest.raises(ValueError, match="base.jsonl and .*community.jsonl"):
+        stages.Catalogue(str(tmp_path))
@@ -0,0 +1,43 @@
+"""
+A malformed stage fails its own jobs without stopping the rest of a run,
+in process and on the worker pool alike.
+
+    python -m pytest test_verify.py
+"""
+
+import json
+
+import pytest
+
+import verify
+
+PROGRAM = "in a0\nin a1\nadd a0 a0 a1\nout a0\nhalt"
+MALFORMED = [
+    {"input": 5, "output": [3]},
+    {"input": ["a"], "output": [3]},
+    {"input": [1.5], "output": [3]},
+    {"input": [1, 2], "output": "3"},
+    {"input": [1, 2], "memory": {"0": "x"}},
+    {"input": [1, 2], "seed": None},
+]
+
+
+def write_stage(path, test: dict) -> str:
+    stage = {"isa": ["BaseMathT2", "IO"], "tests": [test, {"input": [2, 2]}]}
+    path.write_text(json.dumps(stage))
+    return str(path)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_malformed_stages_fail_alone(tmp_path, workers):
+    program = tmp_path / "add.asm"
+    program.write_text(PROGRAM)
+    good = write_stage(tmp_path / "good.json", {"input": [1, 2], "output": [3]})
+    jobs = [(str(program), good)]
+    for i, test in enumerate(MALFORMED):
+        jobs += [(str(program), write_stage(tmp_path / f"bad{i}.json", test))]
+    results = verify.verify_all(jobs, workers)
+    assert results[0]["passed"], results[0]["failures"]
+    for result in results[1:]:
+        assert not result["passed"]
+        assert result["failures"][0].startswith(result["stage"]), result["failures"]
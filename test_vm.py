@@ -0,0 +1,169 @@
+"""
+Differential checks of the fast execution paths against the interpreter:
+the JIT tier of `vm.VM` and the lanes of `batch.BatchVM` must leave
+exactly the state a plain `vm.VM` leaves.
+
+    python -m pytest test_vm.py
+"""
+
+import random
+
+import pytest
+
+import vm
+from testutil import end_state, lane_state, random_program
+
+ISAS = [
+    ["BaseMathT2", "IO", "SysCall"],
+    ["BaseMathT2", "IO", "SysCall", "64-bit Ext"],
+    ["Base", "BaseMathT2", "IO", "SysCall"],
+]
+
+
+def random_case(rng: random.Random, isas=ISAS) -> vm.Program:
+    isa = vm.instruction_set(rng.choice(isas))
+    lines = rng.randrange(3, 25)
+    return vm.assemble(random_program(rng, isa, lines, labels=lines // 3 + 1), isa)
+
+
+@pytest.mark.parametrize("threshold", [1, 2, 5])
+def test_jit_matches_interpreter(monkeypatch, threshold):
+    monkeypatch.setattr(vm, "JIT_THRESHOLD", threshold)
+    rng = random.Random(threshold)
+    for trial in range(200):
+        program = random_case(rng, ISAS + [ISAS[0] + ["DualCore"]])
+        inputs = [rng.randrange(-5, 300) for _ in range(rng.randrange(0, 30))]
+        chunks = [rng.randrange(1, 300) for _ in range(rng.randrange(1, 8))]
+        results = []
+        for jit in (False, True):
+            if program.isa.cores > 1:
+                machine = vm.MultiCore(program, 0, 64, inputs, seed=trial, jit=jit)
+                pages = machine.cores[0].pages
+            else:
+                machine = vm.VM(program, 64, inputs, jit=jit)
+                pages = machine.pages
+            log = [(machine.run(chunk), end_state(machine)) for chunk in chunks]
+            results.append((log, sorted(pages.dirty)))
+        assert results[0] == results[1], program.source
+
+
+def test_batch_matches_vm():
+    batch = pytest.importorskip("batch")
+    rng = random.Random(0)
+    for _ in range(150):
+        program = random_case(rng)
+        inputs = [
+            [rng.randrange(-5, 300) for _ in range(rng.randrange(0, 6))]
+            for _ in range(rng.randrange(1, 40))
+        ]
+        max_steps = rng.choice([0, 1, 50, 500, 3000])
+        lanes = batch.BatchVM(program, inputs, 64)
+        if rng.random() < 0.5:
+            lanes.run(max_steps)
+        else:  # pausing at the limit and resuming must not change anything
+            lanes.run(max_steps // 3)
+            lanes.run(max_steps - max_steps // 3)
+        for lane, lane_inputs in enumerate(inputs):
+            machine = vm.VM(program, 64, lane_inputs)
+            machine.run(max_steps)
+            expected = end_state(machine)
+            assert lane_state(lanes, lane) == expected, (program.source, lane_inputs)
+
+
+# writes every page of two page groups, then reads back what it wrote
+LOOP = """
+#loop
+add a0 a0 1
+mul a1 a0 1237
+mod a1 a1 8192
+store a1 a0
+load a2 a1
+out a2
+jlt a0 3000 loop
+halt
+"""
+
+
+def new_machine(program: vm.Program, memory_size: int, inputs, **kwargs):
+    if program.isa.cores > 1:
+        return vm.MultiCore(program, 0, memory_size, inputs, seed=1, **kwargs)
+    return vm.VM(program, memory_size, inputs, **kwargs)
+
+
+@pytest.mark.parametrize("mapped", [False, True])
+@pytest.mark.parametrize("jit", [False, True])
+def test_timeline_seek_matches_replay(mapped, jit):
+    rng = random.Random(mapped * 2 + jit)
+    cases = [
+        (vm.assemble(LOOP, vm.instruction_set(isa)), 8192, [])
+        for isa in (ISAS[0], ISAS[0] + ["DualCore"])
+    ]
+    for _ in range(10):
+        inputs = [rng.randrange(300) for _ in range(20)]
+        cases.append((random_case(rng, ISAS + [ISAS[0] + ["DualCore"]]), 256, inputs))
+    for program, memory_size, inputs in cases:
+
+        def fresh():
+            return new_machine(program, memory_size, inputs, mapped=mapped, jit=jit)
+
+        timeline = vm.Timeline(fresh(), interval=rng.choice([3, 50, 500]))
+        reached = 0
+        for _ in range(30):
+            if rng.random() < 0.4:
+                timeline.run(rng.randrange(1, 5000))
+                reached = max(reached, timeline.steps)
+                continue
+            # going back restores pages shared with later checkpoints,
+            # which the run after it must not write through
+            target = rng.randint(0, reached)
+            timeline.seek(target)
+            replay = fresh()
+            replay.run(target)
+            assert end_state(timeline.machine) == end_state(replay), program.source
+
+
+def test_watchdog_stops_runaway_programs():
+    # 21 instructions before the `halt`
+    counted = vm.assemble("mov a0 0\n#l\nadd a0 a0 1\njlt a0 10 l\nhalt")
+    for limit in (21, 20):
+        machine = vm.VM(counted)
+        watchdog = vm.Watchdog(machine, frame_steps=5, limit=limit)
+        while not watchdog.finished:
+            assert watchdog.tick() <= 5
+        if limit == 21:
+            assert machine.fault is None and machine.steps == 22
+        else:
+            assert "execution limit of 20 steps exceeded" in str(machine.fault)
+            assert machine.steps == 21
+
+    # a clock that has always run out still lets one chunk through a frame
+    machine = vm.MultiCore(
+        vm.assemble("#l\njump l", vm.instruction_set(["Base", "DualCore"]))
+    )
+    watchdog = vm.Watchdog(machine, limit=10_000, frame_seconds=0)
+    ticks = 0
+    while not watchdog.finished:
+        assert watchdog.tick() <= vm.Watchdog.chunk
+        ticks += 1
+    assert ticks == 11
+    assert machine.steps == 10_001
+    assert "execution limit of 10000 steps exceeded" in str(machine.fault)
+
+
+def test_seed_replays_interleaving():
+    # every core prints its id, so the output is the interleaving
+    program = vm.assemble(
+        "core a0\n#l\nout a0\nadd a1 a1 1\njlt a1 200 l\nhalt",
+        vm.instruction_set(["BaseMathT2", "IO", "OctaCore"]),
+    )
+
+    def interleaving(seed: int, chunk: int) -> list:
+        machine = vm.MultiCore(program, seed=seed)
+        while not machine.halted:
+            machine.run(chunk)
+        return machine.output
+
+    first = interleaving(3, 1_000_000)
+    assert sorted(set(first)) == list(range(8))
+    assert interleaving(3, 7) == first  # however the run is sliced
+    assert interleaving(4, 1_000_000) != first
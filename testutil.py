@@ -0,0 +1,65 @@
+"""
+Helpers shared by the test modules: random programs for differential
+checks and the end state a run leaves behind.
+"""
+
+import random
+
+import vm
+
+VALUES = [0, 1, 2, 3, 7, 15, 16, 31, 63, 64, 65, 200, 255, 1000, 65535, 70000, -1]
+
+
+def random_program(
+    rng: random.Random,
+    isa: "vm.InstructionSet",
+    lines: int,
+    registers: int = 8,
+    labels: int = 4,
+) -> str:
+    """`lines` random instructions of `isa` with `labels` labels between them."""
+    names = [f"l{i}" for i in range(labels)]
+
+    def operand(kind: str) -> str:
+        if kind == "r" or (kind == "v" and rng.random() < 0.5):
+            return f"a{rng.randrange(registers)}"
+        if kind == "l":
+            return rng.choice(names)
+        return str(rng.choice(VALUES + [rng.randrange(1 << 20)]))
+
+    ops = sorted(isa.signatures)
+    body = []
+    for _ in range(lines):
+        op = rng.choice(ops)
+        body.append(" ".join([op] + [operand(kind) for kind in isa.signatures[op]]))
+    for name in names:
+        body.insert(rng.randint(0, len(body)), "#" + name)
+    return "\n".join(body)
+
+
+def end_state(machine) -> dict:
+    """What a `vm.VM` or `vm.MultiCore` run left behind."""
+    cores = machine.cores if isinstance(machine, vm.MultiCore) else [machine]
+    return {
+        "steps": machine.steps,
+        "halted": machine.halted,
+        "fault": machine.fault and str(machine.fault),
+        "output": list(machine.output),
+        "memory": list(machine.memory),
+        "pc": [core.pc for core in cores],
+        "registers": [core.registers[: vm.REGISTER_COUNT] for core in cores],
+    }
+
+
+def lane_state(lanes, lane: int) -> dict:
+    """`end_state` of one lane of a `batch.BatchVM`."""
+    fault = lanes.faults[lane]
+    return {
+        "steps": int(lanes.steps[lane]),
+        "halted": bool(lanes.halted[lane]),
+        "fault": fault and str(fault),
+        "output": list(lanes.outputs[lane]),
+        "memory": lanes.memory[lane].tolist(),
+        "pc": [int(lanes.pc[lane])],
+        "registers": [lanes.registers[: vm.REGISTER_COUNT, lane].tolist()],
+    }
@@ -0,0 +1,246 @@
+"""
+Headless solution verifier.
+
+Checks assembly programs against stage definitions without opening a
+window or touching the mixer, spreading the work over a process pool.
+
+    python verify.py stage.json solution1.asm solution2.asm
+    python verify.py --manifest manifest.json --jobs 8 --json
+
+A stage definition is a JSON file:
+
+```json
+{
+    "name": "helios",
+    "isa": ["Base", "IO"],
+    "memory_size": 256,
+    "max_steps": 100000,
+    "tests": [
+        {"input": [1, 2], "output": [3]},
+        {"input": [5, 5], "output": [10], "memory": {"0": 10}}
+    ]
+}
+```
+
+A test passes when the program halts within `max_steps` without a fault,
+its output matches `output` and every address in `memory` holds the given
+value. Multi-core stages use the test's `seed` (default 0) for scheduling.
+With NumPy installed the tests of a single core stage run together as
+lanes of one `batch.BatchVM`. `--optimize` runs single core programs
+through `analysis.optimize` first, steps and fault positions are then
+those of the optimized program.
+A manifest maps stage files to lists of program files.
+"""
+
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import analysis
+import vm
+
+try:
+    import batch
+except ImportError:  # NumPy is optional, tests then run one at a time
+    batch = None
+
+
+@functools.lru_cache(maxsize=None)
+def load_stage(path: str) -> dict:
+    """Reads and checks a stage definition, raising `ValueError` if malformed."""
+    with open(path) as file:
+        stage = json.load(file)
+    if not isinstance(stage, dict):
+        raise ValueError(f"{path}: a stage must be a JSON object")
+    stage.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    stage.setdefault("memory_size", 256)
+    stage.setdefault("max_steps", 100_000)
+    isa = stage.get("isa")
+    if not (isinstance(isa, list) and all(isinstance(name, str) for name in isa)):
+        raise ValueError(f"{path}: 'isa' must be a list of extensions")
+    for key in ("memory_size", "max_steps"):
+        if not isinstance(stage[key], int) or stage[key] <= 0:
+            raise ValueError(f"{path}: {key!r} must be a positive integer")
+    tests = stage.get("tests")
+    if not isinstance(tests, list) or not tests:
+        raise ValueError(f"{path}: 'tests' must be a non-empty list")
+    for i, test in enumerate(tests):
+        if not isinstance(test, dict):
+            raise ValueError(f"{path}: test {i} must be a JSON object")
+        for key in ("input", "output"):
+            if key in test and not (
+                isinstance(test[key], list) and all(map(is_int, test[key]))
+            ):
+                raise ValueError(f"{path}: test {i}: {key!r} must be a list of ints")
+        if not is_int(test.get("seed", 0)):
+            raise ValueError(f"{path}: test {i}: 'seed' must be an int")
+        if not isinstance(test.get("memory", {}), dict):
+            raise ValueError(f"{path}: test {i}: 'memory' must map addresses")
+        for address, value in test.get("memory", {}).items():
+            if vm.parse_int(address) is None:
+                raise ValueError(f"{path}: test {i}: invalid address {address!r}")
+            if not is_int(value):
+                raise ValueError(f"{path}: test {i}: memory[{address}] must be an int")
+    return stage
+
+
+def is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def run_test(program: vm.Program, stage: dict, test: dict) -> Tuple[int, str]:
+    """Returns the steps taken and a failure message, empty on success."""
+    if program.isa.cores > 1:
+        machine = vm.MultiCore(
+            program,
+            memory_size=stage["memory_size"],
+            input=test.get("input", ()),
+            seed=test.get("seed", 0),
+            jit=True,
+        )
+    else:
+        machine = vm.VM(program, stage["memory_size"], test.get("input", ()), jit=True)
+    machine.run(stage["max_steps"])
+    return machine.steps, check(
+        stage, test, machine.halted, machine.fault, machine.output, machine.memory
+    )
+
+
+def run_tests(program: vm.Program, stage: dict) -> List[Tuple[int, str]]:
+    """`run_test` for every test, batched over NumPy lanes when possible."""
+    tests = stage["tests"]
+    if batch is None or program.isa.cores > 1 or len(tests) < 2:
+        return [run_test(program, stage, test) for test in tests]
+    try:
+        lanes = batch.BatchVM(
+            program, [test.get("input", ()) for test in tests], stage["memory_size"]
+        )
+    except vm.ISAError:  # instructions without a batched implementation
+        return [run_test(program, stage, test) for test in tests]
+    lanes.run(stage["max_steps"])
+    return [
+        (
+            int(lanes.steps[i]),
+            check(
+                stage,
+                test,
+                lanes.halted[i],
+                lanes.faults[i],
+                lanes.outputs[i],
+                lanes.memory[i],
+            ),
+        )
+        for i, test in enumerate(tests)
+    ]
+
+
+def check(stage: dict, test: dict, halted, fault, output, memory) -> str:
+    if fault is not None:
+        return str(fault)
+    if not halted:
+        return f"did not halt within {stage['max_steps']} steps"
+    expected = test.get("output")
+    if expected is not None and output != expected:
+        return f"output {output}, expected {expected}"
+    for address, value in test.get("memory", {}).items():
+        index = int(address, 0)
+        if not 0 <= index < len(memory):
+            return f"memory[{address}] is outside the {len(memory)} words of memory"
+        if memory[index] != value:
+            return f"memory[{address}] is {memory[index]}, expected {value}"
+    return ""
+
+
+def verify(job: Tuple[str, str], optimize: bool = False) -> dict:
+    program_path, stage_path = job
+    start = time.perf_counter()
+    result = {
+        "program": program_path,
+        "stage": stage_path,
+        "passed": False,
+        "steps": 0,
+        "failures": [],
+    }
+    try:
+        stage = load_stage(stage_path)
+        result["stage"] = stage["name"]
+        with open(program_path) as file:
+            program = vm.assemble(file.read(), vm.instruction_set(stage["isa"]))
+        if optimize and program.isa.cores == 1:
+            # scheduling of multi core stages depends on the step count
+            program = analysis.optimize(program)
+        for i, (steps, failure) in enumerate(run_tests(program, stage)):
+            result["steps"] += steps
+            if failure:
+                result["failures"].append(f"test {i}: {failure}")
+    except (OSError, ValueError, KeyError, vm.AsmError, vm.ISAError) as e:
+        result["failures"].append(str(e))
+    result["passed"] = not result["failures"]
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def verify_all(
+    jobs: List[Tuple[str, str]], workers: int = None, optimize: bool = False
+) -> List[dict]:
+    """Verifies `(program, stage)` pairs on every core, keeping job order."""
+    run = functools.partial(verify, optimize=optimize)
+    if workers == 1 or len(jobs) <= 1:
+        return [run(job) for job in jobs]
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers) as pool:
+        chunksize = max(1, len(jobs) // (workers * 4))
+        return list(pool.map(run, jobs, chunksize=chunksize))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("stage", nargs="?", help="stage definition file")
+    parser.add_argument("programs", nargs="*", help="assembly programs")
+    parser.add_argument("--manifest", help="JSON mapping stage files to programs")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes")
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    parser.add_argument(
+        "--optimize", action="store_true", help="optimize programs before running"
+    )
+    args = parser.parse_args(argv)
+
+    jobs = [(program, args.stage) for program in args.programs]
+    if args.manifest:
+        with open(args.manifest) as file:
+            for stage, programs in json.load(file).items():
+                jobs += [(program, stage) for program in programs]
+    if not jobs:
+        parser.error("nothing to verify")
+
+    start = time.perf_counter()
+    results = verify_all(jobs, args.jobs, args.optimize)
+    elapsed = time.perf_counter() - start
+    passed = sum(result["passed"] for result in results)
+    if args.json:
+        json.dump(
+            {"results": results, "passed": passed, "seconds": elapsed},
+            sys.stdout,
+            indent=4,
+        )
+        print()
+    else:
+        for result in results:
+            print(
+                f"{'PASS' if result['passed'] else 'FAIL'}  {result['program']}"
+                f"  [{result['stage']}]  {result['steps']} steps"
+                f"  {result['seconds'] * 1000:.1f} ms"
+            )
+            for failure in result["failures"]:
+                print(f"      {failure}")
+        print(f"{passed}/{len(results)} passed in {elapsed:.2f}s")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1232 @@
+"""
+Assembler and interpreter for the Progventures assembly language.
+
+Programs are assembled once into a compact instruction array where every
+operand is already an integer (register slot, constant slot or jump
+target). Linking a program to a `VM` turns each instruction into a small
+closure that returns the next program counter, so the interpreter loop
+never looks at source text, opcode names or operand kinds again.
+
+```asm
+; count a0 up to 1000
+#loop
+add a0 a0 1
+jlt a0 1000 loop
+halt
+```
+"""
+
+import functools
+import hashlib
+import mmap
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+REGISTER_COUNT = 8
+REGISTER_NAMES = {f"a{i}": i for i in range(REGISTER_COUNT)}
+
+# Snapshots share memory between each other in pages of 2**PAGE_BITS words,
+# held in groups of 2**GROUP_BITS pages so an image of a large memory that
+# changed in a few places is mostly shared too
+PAGE_BITS = 6
+PAGE_SIZE = 1 << PAGE_BITS
+GROUP_BITS = 6
+PAGE_GROUP = 1 << GROUP_BITS
+
+# Memories of at least this many words are backed by an anonymous mmap
+MMAP_WORDS = 1 << 20
+
+# Operand kinds: "r" is a writable register, "v" is a register or an
+# immediate value and "l" is a label.
+BASE_OPCODES = {
+    "nop": "",
+    "halt": "",
+    "mov": "rv",
+    "add": "rvv",
+    "sub": "rvv",
+    "mul": "rvv",
+    "div": "rvv",
+    "mod": "rvv",
+    "and": "rvv",
+    "or": "rvv",
+    "xor": "rvv",
+    "shl": "rvv",
+    "shr": "rvv",
+    "load": "rv",
+    "store": "vv",
+    "jump": "l",
+    "jeq": "vvl",
+    "jne": "vvl",
+    "jlt": "vvl",
+    "jgt": "vvl",
+}
+
+
+class AsmError(Exception):
+    def __init__(self, errors: List[Tuple[int, str]]):
+        self.errors = errors
+        super().__init__(
+            "\n".join(f"line {line + 1}: {message}" for line, message in errors)
+        )
+
+
+class VMError(Exception):
+    def __init__(self, message: str, pc: int):
+        self.pc = pc
+        super().__init__(f"{message} (instruction {pc})")
+
+
+class ISAError(Exception):
+    pass
+
+
+class _Halt(Exception):
+    pass
+
+
+def parse_int(token: str) -> Optional[int]:
+    try:
+        return int(token, 0)
+    except ValueError:
+        return None
+
+
+def parse_line(text: str, opcodes: Dict[str, str] = BASE_OPCODES):
+    """
+    Parses a single source line.
+
+    Returns `None` for blank lines and comments, `("#", name)` for labels
+    and `(op, operands)` for instructions where every operand is one of
+    `("r", register)`, `("i", value)` or `("l", label)`. Raises `ValueError`
+    with a readable message for malformed lines.
+    """
+    text = text.split(";", 1)[0].strip()
+    if text == "":
+        return None
+    if text.startswith("#"):
+        name = text[1:]
+        if name == "" or len(name.split()) != 1:
+            raise ValueError(f"invalid label {text!r}")
+        return ("#", name)
+    op, *tokens = text.split()
+    op = op.lower()
+    if op not in opcodes:
+        raise ValueError(f"unknown instruction {op!r}")
+    signature = opcodes[op]
+    if len(tokens) != len(signature):
+        raise ValueError(f"{op!r} takes {len(signature)} operand(s), got {len(tokens)}")
+    operands = []
+    for kind, token in zip(signature, tokens):
+        if kind == "l":
+            operands.append(("l", token))
+        elif token.lower() in REGISTER_NAMES:
+            operands.append(("r", REGISTER_NAMES[token.lower()]))
+        elif kind == "r":
+            raise ValueError(f"{op!r} needs a register, got {token!r}")
+        else:
+            value = parse_int(token)
+            if value is None:
+                raise ValueError(f"invalid operand {token!r}")
+            operands.append(("i", value))
+    return (op, tuple(operands))
+
+
+class Program:
+    """
+    An assembled program.
+
+    `code` holds `(op, operands)` pairs with integer operands: registers
+    are slots `0..REGISTER_COUNT-1`, immediates are slots after the
+    registers indexing `consts`, and labels are instruction indices.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.hash = hashlib.sha1(source.encode()).hexdigest()
+        self.code: List[Tuple[str, Tuple[int, ...]]] = []
+        self.lines: List[int] = []
+        self.consts: List[int] = []
+        self.labels: Dict[str, int] = {}
+        self.label_lines: Dict[str, int] = {}
+        self.isa: Optional[InstructionSet] = None
+
+    def __len__(self):
+        return len(self.code)
+
+
+def parse_lines(lines: List[str], opcodes: Dict[str, str] = BASE_OPCODES) -> list:
+    """
+    `parse_line` over many lines. Malformed lines become `("!", message)`
+    instead of raising so the results can be cached per line.
+    """
+    parsed = []
+    for text in lines:
+        try:
+            parsed.append(parse_line(text, opcodes))
+        except ValueError as e:
+            parsed.append(("!", str(e)))
+    return parsed
+
+
+def assemble_parsed(source: str, parsed: list) -> Tuple[Program, List[Tuple[int, str]]]:
+    """
+    One pass assembler over the output of `parse_lines`. Forward label
+    references are backpatched once the label is seen. Returns the program
+    together with every error found instead of stopping at the first one.
+    """
+    program = Program(source)
+    errors = []
+    const_slots = {}
+    fixups = []  # (instruction, operand index, label, line)
+    for i, line in enumerate(parsed):
+        if line is None:
+            continue
+        if line[0] == "!":
+            errors.append((i, line[1]))
+            continue
+        if line[0] == "#":
+            name = line[1]
+            if name in program.labels:
+                errors.append((i, f"duplicate label {name!r}"))
+            else:
+                program.labels[name] = len(program.code)
+                program.label_lines[name] = i
+            continue
+        op, operands = line
+        encoded = []
+        for kind, value in operands:
+            if kind == "r":
+                encoded.append(value)
+            elif kind == "i":
+                if value not in const_slots:
+                    const_slots[value] = REGISTER_COUNT + len(program.consts)
+                    program.consts.append(value)
+                encoded.append(const_slots[value])
+            else:
+                fixups.append((len(program.code), len(encoded), value, i))
+                encoded.append(-1)
+        program.code.append((op, encoded))
+        program.lines.append(i)
+    for index, position, label, line in fixups:
+        if label not in program.labels:
+            errors.append((line, f"undefined label {label!r}"))
+            continue
+        program.code[index][1][position] = program.labels[label]
+    program.code = [(op, tuple(operands)) for op, operands in program.code]
+    errors.sort()
+    return program, errors
+
+
+def assemble_lines(
+    lines: List[str], isa: "InstructionSet" = None
+) -> Tuple[Program, List[Tuple[int, str]]]:
+    isa = isa or instruction_set(["Base"])
+    program, errors = assemble_parsed(
+        "\n".join(lines), parse_lines(lines, isa.signatures)
+    )
+    program.isa = isa
+    return program, errors
+
+
+def assemble(source: str, isa: "InstructionSet" = None) -> Program:
+    program, errors = assemble_lines(source.splitlines(), isa)
+    if errors:
+        raise AsmError(errors)
+    return program
+
+
+# Step factories. Each one receives the VM, the instruction index and the
+# decoded operands and returns a closure that executes the instruction and
+# returns the next program counter.
+
+
+def _op_nop(vm, pc):
+    nxt = pc + 1
+    return lambda: nxt
+
+
+def _op_halt(vm, pc):
+    def step():
+        raise _Halt
+
+    return step
+
+
+def _op_mov(vm, pc, d, a):
+    R, nxt = vm.registers, pc + 1
+
+    def step():
+        R[d] = R[a]
+        return nxt
+
+    return step
+
+
+def _binary(fn):
+    def factory(vm, pc, d, a, b):
+        R, mask, nxt = vm.registers, vm.mask, pc + 1
+
+        def step():
+            R[d] = fn(R[a], R[b]) & mask
+            return nxt
+
+        return step
+
+    return factory
+
+
+def _op_add(vm, pc, d, a, b):
+    R, mask, nxt = vm.registers, vm.mask, pc + 1
+
+    def step():
+        R[d] = (R[a] + R[b]) & mask
+        return nxt
+
+    return step
+
+
+def _op_sub(vm, pc, d, a, b):
+    R, mask, nxt = vm.registers, vm.mask, pc + 1
+
+    def step():
+        R[d] = (R[a] - R[b]) & mask
+        return nxt
+
+    return step
+
+
+def _op_load(vm, pc, d, a):
+    R, M, nxt = vm.registers, vm.memory, pc + 1
+
+    def step():
+        R[d] = M[R[a]]
+        return nxt
+
+    return step
+
+
+def _op_store(vm, pc, a, b):
+    R, M, nxt = vm.registers, vm.memory, pc + 1
+    dirty = vm.pages.dirty
+
+    def step():
+        address = R[a]
+        M[address] = R[b]
+        dirty.add(address >> PAGE_BITS)
+        return nxt
+
+    return step
+
+
+def _op_jump(vm, pc, target):
+    return lambda: target
+
+
+def _branch(compare):
+    def factory(vm, pc, a, b, target):
+        R, nxt = vm.registers, pc + 1
+        if compare == "eq":
+            return lambda: target if R[a] == R[b] else nxt
+        if compare == "ne":
+            return lambda: target if R[a] != R[b] else nxt
+        if compare == "lt":
+            return lambda: target if R[a] < R[b] else nxt
+        return lambda: target if R[a] > R[b] else nxt
+
+    return factory
+
+
+def _op_in(vm, pc, d):
+    R, inp, mask, nxt = vm.registers, vm.input, vm.mask, pc + 1
+
+    def step():
+        if not inp:
+            raise VMError("input exhausted", pc)
+        R[d] = inp.popleft() & mask
+        return nxt
+
+    return step
+
+
+def _op_out(vm, pc, a):
+    R, out, nxt = vm.registers, vm.output, pc + 1
+
+    def step():
+        out.append(R[a])
+        return nxt
+
+    return step
+
+
+def _op_sys(vm, pc, a):
+    R, syscall, nxt = vm.registers, vm.syscall, pc + 1
+
+    def step():
+        syscall(R[a], pc)
+        return nxt
+
+    return step
+
+
+def _op_core(vm, pc, d):
+    R, nxt = vm.registers, pc + 1
+
+    def step():
+        R[d] = vm.core_id
+        return nxt
+
+    return step
+
+
+BASE_FACTORIES = {
+    "nop": _op_nop,
+    "halt": _op_halt,
+    "mov": _op_mov,
+    "add": _op_add,
+    "sub": _op_sub,
+    "mul": _binary(lambda a, b: a * b),
+    "div": _binary(lambda a, b: a // b),
+    "mod": _binary(lambda a, b: a % b),
+    "and": _binary(lambda a, b: a & b),
+    "or": _binary(lambda a, b: a | b),
+    "xor": _binary(lambda a, b: a ^ b),
+    "shl": _binary(lambda a, b: a << b if b < 128 else 0),
+    "shr": _binary(lambda a, b: a >> b),
+    "load": _op_load,
+    "store": _op_store,
+    "jump": _op_jump,
+    "jeq": _branch("eq"),
+    "jne": _branch("ne"),
+    "jlt": _branch("lt"),
+    "jgt": _branch("gt"),
+}
+
+
+class Extension:
+    """
+    An ISA extension as listed in a stage's `isa`. `opcodes` maps an
+    instruction name to `(signature, step factory)`; `bits` and `cores`
+    raise the word size and core count of any set that includes it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        opcodes: Dict[str, tuple] = None,
+        includes: Tuple[str, ...] = (),
+        bits: int = 0,
+        cores: int = 0,
+    ):
+        self.name = name
+        self.opcodes = opcodes or {}
+        self.includes = includes
+        self.bits = bits
+        self.cores = cores
+
+
+EXTENSIONS: Dict[str, Extension] = {}
+
+
+def register_extension(name: str, **kwargs) -> Extension:
+    EXTENSIONS[name] = Extension(name, **kwargs)
+    _instruction_set.cache_clear()
+    return EXTENSIONS[name]
+
+
+class InstructionSet:
+    """
+    Flat opcode tables for one exact combination of extensions. Anything
+    not in `signatures` is rejected by the assembler, so the interpreter
+    never has to ask whether an instruction is allowed.
+    """
+
+    def __init__(self, names: frozenset):
+        self.names = names
+        self.signatures: Dict[str, str] = {}
+        self.factories: Dict[str, object] = {}
+        self.bits = 0
+        self.cores = 1
+        owners = {}
+        for ext in self._resolve(names):
+            self.bits = max(self.bits, ext.bits)
+            self.cores = max(self.cores, ext.cores)
+            for op, (signature, factory) in ext.opcodes.items():
+                if op in owners and self.factories[op] is not factory:
+                    raise ISAError(
+                        f"{op!r} is defined by both {owners[op]!r} and {ext.name!r}"
+                    )
+                owners[op] = ext.name
+                self.signatures[op] = signature
+                self.factories[op] = factory
+        self.bits = self.bits or 16
+        self.mask = (1 << self.bits) - 1
+
+    @staticmethod
+    def _resolve(names) -> List[Extension]:
+        seen, order = set(), []
+
+        def visit(name):
+            if name in seen:
+                return
+            if name not in EXTENSIONS:
+                raise ISAError(f"unknown ISA extension {name!r}")
+            seen.add(name)
+            for dep in EXTENSIONS[name].includes:
+                visit(dep)
+            order.append(EXTENSIONS[name])
+
+        for name in sorted(names):
+            visit(name)
+        return order
+
+
+@functools.lru_cache(maxsize=None)
+def _instruction_set(names: frozenset) -> InstructionSet:
+    return InstructionSet(names)
+
+
+def instruction_set(isa) -> InstructionSet:
+    """Cached `InstructionSet` for a stage's `isa` list."""
+    return _instruction_set(frozenset(isa))
+
+
+register_extension(
+    "Base",
+    opcodes={op: (BASE_OPCODES[op], BASE_FACTORIES[op]) for op in BASE_OPCODES},
+    bits=16,
+)
+register_extension("BaseT2", includes=("Base",), bits=32)
+register_extension(
+    "BaseMathT2",
+    includes=("BaseT2",),
+    opcodes={
+        "min": ("rvv", _binary(min)),
+        "max": ("rvv", _binary(max)),
+    },
+)
+register_extension("IO", opcodes={"in": ("r", _op_in), "out": ("v", _op_out)})
+register_extension("EnclaveIO", includes=("IO",))
+register_extension("HubIO", includes=("IO",))
+register_extension("SysCall", opcodes={"sys": ("v", _op_sys)})
+register_extension("Syscall", includes=("SysCall",))
+register_extension("Verified Syscall", includes=("SysCall",))
+register_extension("32-bit Ext", bits=32)
+register_extension("64-bit Ext", includes=("32-bit Ext",), bits=64)
+register_extension("DualCore", opcodes={"core": ("r", _op_core)}, cores=2)
+register_extension("OctaCore", includes=("DualCore",), cores=8)
+# Stage flavour without instructions of their own yet
+for _name in (
+    "SingleRegister",
+    "SecureReg",
+    "Redundent Registers",
+    "ECC Memory",
+    "Network",
+    "CSR",
+    "GPU",
+):
+    register_extension(_name)
+
+
+def allocate_memory(size: int, bits: int, mapped: bool = None):
+    """
+    Zeroed memory of `size` unsigned words of at least `bits` bits, as an
+    `array`, or as a typed `memoryview` over an anonymous mmap when
+    `mapped` (by default for `MMAP_WORDS` words and up) so pages the
+    program never touches cost nothing.
+    """
+    for typecode in "BHILQ":
+        if array(typecode).itemsize * 8 >= bits:
+            break
+    else:
+        raise ISAError(f"no memory type holds {bits} bit words")
+    if mapped is None:
+        mapped = size >= MMAP_WORDS
+    if not mapped:
+        return array(typecode, bytes(size * array(typecode).itemsize))
+    if not size:
+        return memoryview(b"").cast(typecode)
+    return memoryview(mmap.mmap(-1, size * array(typecode).itemsize)).cast(typecode)
+
+
+class PagedMemory:
+    """
+    Copy-on-write page images of a freshly allocated, zeroed VM memory.
+    An image is a tuple of groups of `PAGE_GROUP` pages, each page the
+    bytes of `PAGE_SIZE` words. Stores mark the page they wrote as dirty,
+    so `capture` only copies pages (and groups) written since the last
+    capture and shares everything else with it, and `restore` only
+    rewrites pages that differ from the image being restored.
+    """
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.raw = memoryview(memory).cast("B")
+        self.page_bytes = PAGE_SIZE * memoryview(memory).itemsize
+        self.dirty = set()
+        pages = -(-len(memory) // PAGE_SIZE)
+        tail = len(self.raw) - (pages - 1) * self.page_bytes
+        zero = bytes(self.page_bytes)
+        groups = [(zero,) * PAGE_GROUP] * (pages >> GROUP_BITS)
+        if pages & PAGE_GROUP - 1:
+            groups.append((zero,) * (pages & PAGE_GROUP - 1))
+        if pages:  # the last page may be short
+            last = groups[-1]
+            groups[-1] = last[:-1] + (bytes(tail),)
+        self.image = tuple(groups)
+
+    def capture(self) -> tuple:
+        if self.dirty:
+            image = list(self.image)
+            raw, size = self.raw, self.page_bytes
+            groups = {}
+            for page in self.dirty:
+                group = groups.get(page >> GROUP_BITS)
+                if group is None:
+                    group = groups[page >> GROUP_BITS] = list(image[page >> GROUP_BITS])
+                start = page * size
+                group[page & PAGE_GROUP - 1] = bytes(raw[start : start + size])
+            for i, group in groups.items():
+                image[i] = tuple(group)
+            self.dirty.clear()
+            self.image = tuple(image)
+        return self.image
+
+    def restore(self, image: tuple):
+        raw, size = self.raw, self.page_bytes
+        changed = set(self.dirty)
+        if image is not self.image:
+            for i, (old, new) in enumerate(zip(self.image, image)):
+                if old is not new:
+                    first = i << GROUP_BITS
+                    changed.update(
+                        first + j
+                        for j, (a, b) in enumerate(zip(old, new))
+                        if a is not b
+                    )
+        for page in changed:
+            start = page * size
+            raw[start : start + size] = image[page >> GROUP_BITS][page & PAGE_GROUP - 1]
+        self.dirty.clear()
+        self.image = image
+
+
+class Snapshot:
+    """
+    State of a `VM` or `MultiCore` at `steps`. Memory pages are shared
+    with other snapshots of the same machine.
+    """
+
+    __slots__ = ("steps", "cores", "memory", "input", "output", "scheduler")
+
+    def __init__(self, steps, cores, memory, input, output, scheduler=None):
+        self.steps = steps
+        self.cores = cores  # (pc, steps, halted, fault, registers) per core
+        self.memory = memory
+        self.input = input
+        self.output = output  # length, output is append only
+        self.scheduler = scheduler
+
+
+# Basic block compiler. A block is the straight-line run of instructions
+# from some pc up to and including the first jump, branch, halt or system
+# call. It becomes one Python function with the registers it touches held
+# in locals and constants inlined, which returns the next pc. Instructions
+# that can fault record their offset in `k` first, so a faulting block
+# writes its registers back and reports how far it got through
+# `vm.block_exit`, leaving the VM exactly as the interpreter would.
+
+JIT_THRESHOLD = 50  # executions of an instruction before its block compiles
+JIT_MAX_BLOCK = 64  # instructions per block
+JIT_CACHE_SIZE = 4096  # compiled blocks kept across VMs
+
+_jit_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_jit_lock = threading.Lock()
+
+# Python expressions of the ops that assign a register, by op name
+_JIT_EXPRESSIONS = {
+    "mov": "{a}",
+    "add": "({a} + {b}) & {mask}",
+    "sub": "({a} - {b}) & {mask}",
+    "mul": "({a} * {b}) & {mask}",
+    "div": "({a} // {b}) & {mask}",
+    "mod": "({a} % {b}) & {mask}",
+    "and": "{a} & {b}",
+    "or": "{a} | {b}",
+    "xor": "{a} ^ {b}",
+    "shl": "({a} << {b} if {b} < 128 else 0) & {mask}",
+    "shr": "{a} >> {b}",
+    "min": "min({a}, {b})",
+    "max": "max({a}, {b})",
+    "load": "M[{a}]",
+    "core": "vm.core_id",
+}
+_JIT_FAULTING = {"div", "mod", "load", "store", "in", "sys", "halt"}
+_JIT_BRANCHES = {"jeq": "==", "jne": "!=", "jlt": "<", "jgt": ">"}
+# Extensions whose step factories the compiler (and `analysis`) mirrors;
+# an op whose factory was replaced or comes from elsewhere ends the block
+_JIT_OWNERS = {
+    "Base": set(BASE_OPCODES),
+    "BaseMathT2": {"min", "max"},
+    "IO": {"in", "out"},
+    "SysCall": {"sys"},
+    "DualCore": {"core"},
+}
+
+
+def builtin_ops() -> Dict[object, str]:
+    """
+    Step factory -> op name for every built-in instruction, the ones the
+    compiler and the static passes know the meaning of.
+    """
+    return {
+        EXTENSIONS[name].opcodes[op][1]: op
+        for name, ops in _JIT_OWNERS.items()
+        if name in EXTENSIONS
+        for op in ops
+    }
+
+
+def block_source(program: Program, isa: "InstructionSet", start: int) -> tuple:
+    """
+    Python source of the block starting at `start` and its length, or
+    `(None, 0)` when its first instruction can not be compiled.
+    """
+    known = builtin_ops()
+    mask = isa.mask
+    consts = program.consts
+
+    def value(slot: int) -> str:
+        if slot < REGISTER_COUNT:
+            used.add(slot)
+            return f"r{slot}"
+        return str(consts[slot - REGISTER_COUNT] & mask)
+
+    used = set()
+    body = []
+    end = None  # code returning the next pc
+    pc = start
+    while pc <= len(program.code) and pc - start < JIT_MAX_BLOCK:
+        if pc == len(program.code):
+            op, operands = "halt", ()  # falling off the end
+        else:
+            op, operands = program.code[pc]
+            if known.get(isa.factories[op]) != op:
+                break
+        offset = pc - start
+        pc += 1
+        if op in _JIT_FAULTING:
+            body.append(f"k = {offset}")
+        if op in _JIT_EXPRESSIONS:
+            d, *sources = (value(slot) for slot in operands)
+            sources += [None] * (2 - len(sources))
+            expression = _JIT_EXPRESSIONS[op].format(
+                a=sources[0], b=sources[1], mask=mask
+            )
+            body.append(f"{d} = {expression}")
+        elif op == "store":
+            a, b = value(operands[0]), value(operands[1])
+            body.append(f"M[{a}] = {b}")
+            body.append(f"dirty.add({a} >> {PAGE_BITS})")
+        elif op == "in":
+            body.append(f"if not inp:\n    raise VMError('input exhausted', {pc - 1})")
+            body.append(f"{value(operands[0])} = inp.popleft() & {mask}")
+        elif op == "out":
+            body.append(f"out.append({value(operands[0])})")
+        elif op == "halt":
+            body.append("raise _Halt")
+            end = ""
+            break
+        elif op == "sys":
+            # stage defined calls may look at the registers
+            end = (
+                f"vm.block_exit = {offset}\n"
+                f"syscall({value(operands[0])}, {pc - 1})\n"
+                f"return {pc}"
+            )
+            break
+        elif op == "jump":
+            end = f"return {operands[0]}"
+            break
+        elif op in _JIT_BRANCHES:
+            a, b = value(operands[0]), value(operands[1])
+            compare = _JIT_BRANCHES[op]
+            end = f"return {operands[2]} if {a} {compare} {b} else {pc}"
+            break
+    size = pc - start
+    if not size:
+        return None, 0
+    if end is None:
+        end = f"return {pc}"
+    names = sorted(used)
+    load = "".join(f"    r{i} = R[{i}]\n" for i in names)
+    store = "".join(f"R[{i}] = r{i}\n" for i in names)
+
+    def indent(text: str, spaces: int) -> str:
+        return "".join(" " * spaces + line + "\n" for line in text.splitlines())
+
+    source = (
+        "def make(R, M, dirty, inp, out, syscall, vm, _Halt, VMError):\n"
+        "  def block():\n" + load + "    k = 0\n"
+        "    try:\n"
+        + indent("\n".join(body) or "pass", 6)
+        + "    except Exception:\n"
+        + indent(store, 6)
+        + "      vm.block_exit = k\n"
+        "      raise\n" + indent(store + end, 4) + "  return block\n"
+    )
+    return source, size
+
+
+def compile_block(vm: "VM", start: int) -> Optional[tuple]:
+    """
+    `(function, size)` of the block at `start` bound to `vm`, or None.
+    The compiled code is shared by every VM running the same program on
+    the same instruction set.
+    """
+    program = vm.program
+    key = (program.hash, vm.isa.names, start)
+    with _jit_lock:
+        compiled = _jit_cache.get(key)
+        if compiled is not None:
+            _jit_cache.move_to_end(key)
+    if compiled is None:
+        source, size = block_source(program, vm.isa, start)
+        make = None
+        if source is not None:
+            scope = {}
+            exec(compile(source, f"<block {program.hash[:8]}:{start}>", "exec"), scope)
+            make = scope["make"]
+        compiled = (make, size)
+        with _jit_lock:
+            _jit_cache[key] = compiled
+            if len(_jit_cache) > JIT_CACHE_SIZE:
+                _jit_cache.popitem(last=False)
+    make, size = compiled
+    if make is None:
+        return None
+    function = make(
+        vm.registers,
+        vm.memory,
+        vm.pages.dirty,
+        vm.input,
+        vm.output,
+        vm.syscall,
+        vm,
+        _Halt,
+        VMError,
+    )
+    return (function, size)
+
+
+class VM:
+    """
+    Executes a `Program`. Registers and constants share one list so an
+    operand is always a plain index, immediates never need a type check.
+    Memory is a typed buffer of unsigned words, see `allocate_memory`;
+    `dump` hands out slices of it without copying.
+    """
+
+    def __init__(
+        self,
+        program: Program,
+        memory_size: int = 256,
+        input=(),
+        core_id: int = 0,
+        shared: "VM" = None,
+        mapped: bool = None,
+        jit: bool = False,
+    ):
+        isa = program.isa or instruction_set(["Base"])
+        self.program = program
+        self.isa = isa
+        self.bits = isa.bits
+        self.mask = isa.mask
+        self.registers = [0] * REGISTER_COUNT + [c & self.mask for c in program.consts]
+        if shared is None:
+            self.memory = allocate_memory(memory_size, self.bits, mapped)
+            self.pages = PagedMemory(self.memory)
+            self.input = deque(input)
+            self.output: List[int] = []
+        else:  # another core of the same machine
+            self.memory = shared.memory
+            self.pages = shared.pages
+            self.input = shared.input
+            self.output = shared.output
+        self.core_id = core_id
+        self.pc = 0
+        self.steps = 0
+        self.halted = False
+        self.fault: Optional[VMError] = None
+        factories = isa.factories
+        self.code = [
+            factories[op](self, pc, *operands)
+            for pc, (op, operands) in enumerate(program.code)
+        ]
+        self.code.append(_op_halt(self, len(self.code)))  # falling off the end
+        # Tiered execution, see `_run_tiered`
+        self.jit = jit
+        self.heat = [0] * len(self.code)
+        self.blocks: List[Optional[tuple]] = [None] * len(self.code)
+        self.block_exit = 0
+
+    def run(self, max_steps: int) -> int:
+        """
+        Runs at most `max_steps` instructions and returns how many were
+        executed. Stops early on `halt` or a fault, see `halted` and `fault`.
+        """
+        if self.halted:
+            return 0
+        if self.jit:
+            return self._run_tiered(max_steps)
+        code = self.code
+        pc = self.pc
+        done = 0
+        try:
+            for done in range(max_steps):
+                pc = code[pc]()
+            else:
+                done = max_steps
+        except _Halt:
+            self.halted = True
+            done += 1
+        except ZeroDivisionError:
+            self._trap("division by zero", pc)
+        except IndexError:
+            self._trap("memory access out of range", pc)
+        except VMError as e:
+            self.halted = True
+            self.fault = e
+        self.pc = pc
+        self.steps += done
+        return done
+
+    def _run_tiered(self, max_steps: int) -> int:
+        """
+        `run` with a JIT tier. Instructions are interpreted and counted
+        until one was executed `JIT_THRESHOLD` times; the straight-line
+        block starting there is then compiled to a Python function (see
+        `compile_block`) which runs whenever it fits in the step budget.
+        """
+        code, blocks, heat = self.code, self.blocks, self.heat
+        pc = self.pc
+        done = 0
+        block_start = -1
+        try:
+            while done < max_steps:
+                block = blocks[pc]
+                if block is not None and block[1] <= max_steps - done:
+                    block_start = pc
+                    pc = block[0]()
+                    block_start = -1
+                    done += block[1]
+                    continue
+                heat[pc] += 1
+                if heat[pc] == JIT_THRESHOLD:
+                    blocks[pc] = compile_block(self, pc)
+                    if blocks[pc] is not None:
+                        continue
+                pc = code[pc]()
+                done += 1
+        except (_Halt, ZeroDivisionError, IndexError, VMError) as e:
+            if block_start >= 0:  # the block reports how far it got
+                done += self.block_exit
+                pc = block_start + self.block_exit
+            if isinstance(e, _Halt):
+                self.halted = True
+                done += 1
+            elif isinstance(e, ZeroDivisionError):
+                self._trap("division by zero", pc)
+            elif isinstance(e, IndexError):
+                self._trap("memory access out of range", pc)
+            else:
+                self.halted = True
+                self.fault = e
+        self.pc = pc
+        self.steps += done
+        return done
+
+    def dump(self, start: int = 0, end: int = None) -> memoryview:
+        """Words `start:end` of memory as a view, not a copy."""
+        return memoryview(self.memory)[start:end]
+
+    def snapshot(self) -> Snapshot:
+        return Snapshot(
+            self.steps,
+            (self._core_state(),),
+            self.pages.capture(),
+            tuple(self.input),
+            len(self.output),
+        )
+
+    def restore(self, snapshot: Snapshot):
+        """Returns to a snapshot taken from this VM."""
+        self._restore_core(snapshot.cores[0])
+        _restore_shared(self, snapshot)
+
+    def _core_state(self) -> tuple:
+        return (self.pc, self.steps, self.halted, self.fault, tuple(self.registers))
+
+    def _restore_core(self, state: tuple):
+        self.pc, self.steps, self.halted, self.fault, registers = state
+        self.registers[:] = registers  # step closures hold on to the list
+
+    def syscall(self, number: int, pc: int):
+        """`sys 0` halts, other numbers are for stages to define."""
+        if number == 0:
+            raise _Halt
+        raise VMError(f"unknown system call {number}", pc)
+
+    def kill(self, message: str):
+        self._trap(message, self.pc)
+
+    def _trap(self, message: str, pc: int):
+        self.halted = True
+        self.fault = VMError(message, pc)
+
+
+def _restore_shared(vm: VM, snapshot: Snapshot):
+    vm.pages.restore(snapshot.memory)
+    vm.input.clear()
+    vm.input.extend(snapshot.input)
+    del vm.output[snapshot.output :]
+
+
+class MultiCore:
+    """
+    Several cores sharing memory and IO, interleaved by a seeded scheduler.
+
+    Every round the scheduler shuffles the live cores and gives each a
+    random quantum of `quantum[0]..quantum[1]` instructions which the core
+    runs in one `VM.run` call, so scheduling costs one Python iteration
+    per quantum instead of one per instruction. The schedule only depends
+    on `seed`, never on how `run` calls are sliced, so a race condition
+    found once replays exactly with the same seed.
+    """
+
+    def __init__(
+        self,
+        programs,
+        cores: int = 0,
+        memory_size: int = 256,
+        input=(),
+        seed: int = 0,
+        quantum: Tuple[int, int] = (8, 64),
+        mapped: bool = None,
+        jit: bool = False,
+    ):
+        if isinstance(programs, Program):
+            isa = programs.isa or instruction_set(["Base"])
+            programs = [programs] * (cores or isa.cores)
+        self.seed = seed
+        self.quantum = quantum
+        self.rng = random.Random(seed)
+        first = VM(programs[0], memory_size, input, mapped=mapped, jit=jit)
+        self.cores = [first] + [
+            VM(program, core_id=i, shared=first, jit=jit)
+            for i, program in enumerate(programs[1:], 1)
+        ]
+        self.memory = first.memory
+        self.output = first.output
+        self.steps = 0
+        self.halted = False
+        self.fault: Optional[VMError] = None
+        self._round: List[list] = []  # [core, instructions left in quantum]
+
+    def _next_round(self):
+        live = [core for core in self.cores if not core.halted]
+        self.rng.shuffle(live)
+        lo, hi = self.quantum
+        randint = self.rng.randint
+        self._round = [[core, randint(lo, hi)] for core in reversed(live)]
+
+    def run(self, max_steps: int) -> int:
+        """Runs at most `max_steps` instructions summed over all cores."""
+        done = 0
+        while done < max_steps and not self.halted:
+            if not self._round:
+                self._next_round()
+                if not self._round:
+                    self.halted = True
+                    break
+            slot = self._round[-1]
+            core = slot[0]
+            ran = core.run(min(slot[1], max_steps - done))
+            done += ran
+            slot[1] -= ran
+            if core.fault is not None:
+                self.fault = core.fault
+                self.halted = True
+            elif core.halted or slot[1] <= 0:
+                self._round.pop()
+        self.steps += done
+        return done
+
+    def dump(self, start: int = 0, end: int = None) -> memoryview:
+        return self.cores[0].dump(start, end)
+
+    def snapshot(self) -> Snapshot:
+        first = self.cores[0]
+        return Snapshot(
+            self.steps,
+            tuple(core._core_state() for core in self.cores),
+            first.pages.capture(),
+            tuple(first.input),
+            len(self.output),
+            (
+                self.halted,
+                self.fault,
+                self.rng.getstate(),
+                tuple((core.core_id, left) for core, left in self._round),
+            ),
+        )
+
+    def restore(self, snapshot: Snapshot):
+        for core, state in zip(self.cores, snapshot.cores):
+            core._restore_core(state)
+        _restore_shared(self.cores[0], snapshot)
+        self.steps = snapshot.steps
+        self.halted, self.fault, rng, round = snapshot.scheduler
+        self.rng.setstate(rng)
+        self._round = [[self.cores[i], left] for i, left in round]
+
+    def kill(self, message: str):
+        core = self._round[-1][0] if self._round else self.cores[0]
+        for each in self.cores:
+            each.halted = True
+        self.halted = True
+        self.fault = VMError(message, core.pc)
+
+
+class Watchdog:
+    """
+    Runs a `VM` or `MultiCore` in bounded slices so a frame loop never
+    stalls on player code. Each `tick` executes at most `frame_steps`
+    instructions, stopping early once `frame_seconds` have passed, and
+    the machine is killed when it runs past `limit` steps in total.
+    """
+
+    chunk = 1000  # instructions between clock checks
+
+    def __init__(
+        self,
+        machine,
+        frame_steps: int = 100_000,
+        limit: int = None,
+        frame_seconds: float = None,
+    ):
+        self.machine = machine
+        self.frame_steps = frame_steps
+        self.limit = limit
+        self.frame_seconds = frame_seconds
+        self.last_steps = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.machine.halted
+
+    def tick(self) -> int:
+        """Runs one frame worth of instructions, returns how many ran."""
+        machine = self.machine
+        budget = self.frame_steps
+        if self.limit is not None:
+            # one past the limit so a program halting exactly on it survives
+            budget = min(budget, self.limit + 1 - machine.steps)
+        done = 0
+        if self.frame_seconds is None:
+            done = machine.run(budget)
+        else:
+            deadline = time.perf_counter() + self.frame_seconds
+            while done < budget and not machine.halted:
+                done += machine.run(min(self.chunk, budget - done))
+                if time.perf_counter() >= deadline:
+                    break
+        if self.limit is not None and not machine.halted and machine.steps > self.limit:
+            machine.kill(f"execution limit of {self.limit} steps exceeded")
+        self.last_steps = done
+        return done
+
+
+class Timeline:
+    """
+    Records a `VM` or `MultiCore` so it can be rewound. A snapshot is
+    taken every `interval` steps and `seek` restores the closest one
+    before the target and re-executes the rest, so seeking costs at most
+    `interval` instructions and a checkpoint costs the registers plus the
+    memory pages written since the previous one. Machines are
+    deterministic, so checkpoints past a seek target stay valid. Output
+    is append only, so snapshots store its length and the timeline keeps
+    the longest output seen to replay a seek forward.
+
+    Has the `run`/`kill`/`steps`/`halted`/`fault` interface of the
+    machine and can be driven by a `Watchdog`.
+    """
+
+    def __init__(self, machine, interval: int = 1000):
+        self.machine = machine
+        self.interval = interval
+        self.checkpoints: List[Snapshot] = [machine.snapshot()]
+        self.marks: List[int] = [machine.steps]
+        self.output: List[int] = list(machine.output)
+
+    steps = property(lambda self: self.machine.steps)
+    halted = property(lambda self: self.machine.halted)
+    fault = property(lambda self: self.machine.fault)
+
+    def run(self, max_steps: int) -> int:
+        machine = self.machine
+        done = 0
+        while done < max_steps and not machine.halted:
+            boundary = (machine.steps // self.interval + 1) * self.interval
+            ran = machine.run(min(boundary - machine.steps, max_steps - done))
+            done += ran
+            if machine.steps == boundary and boundary > self.marks[-1]:
+                self.checkpoints.append(machine.snapshot())
+                self.marks.append(boundary)
+            if not ran:
+                break
+        return done
+
+    def seek(self, step: int):
+        """Puts the machine in its state after `step` instructions."""
+        i = bisect_right(self.marks, step) - 1
+        checkpoint = self.checkpoints[i]
+        output = self.machine.output
+        self.output += output[len(self.output) :]
+        self.machine.restore(checkpoint)
+        output += self.output[len(output) : checkpoint.output]
+        self.run(step - self.marks[i])
+
+    def step_back(self, steps: int = 1):
+        self.seek(max(0, self.machine.steps - steps))
+
+    def kill(self, message: str):
+        self.machine.kill(message)
+
+
+def throughput(source: str, steps: int = 1_000_000, isa=("Base",), **kwargs) -> float:
+    """Instructions per second for `source`, restarting it when it halts."""
+    program = assemble(source, instruction_set(isa))
+    vm = VM(program, **kwargs)
+    done = 0
+    start = time.perf_counter()
+    while done < steps:
+        done += vm.run(steps - done)
+        if vm.halted:
+            vm = VM(program, **kwargs)
+    return done / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    sample = """
+    #loop
+    add a0 a0 1
+    and a1 a0 255
+    store a1 a0
+    jne a0 0 loop
+    """
+    print(f"{throughput(sample):,.0f} instructions/sec")